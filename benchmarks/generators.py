@@ -0,0 +1,149 @@
+"""
+Synthetic documents for the benchmarks. Every generator returns
+the root node and the stylesheet to lay it out with. The root is
+sized by a Resizer nudgeteer, like the one in demo.py.
+"""
+import random
+from xylem.constrainer import promote, slack
+from xylem.nodes import Node
+
+class Resizer:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def __call__(self, node):
+        return ResizeSolver(self, node)
+
+class ResizeSolver:
+    def __init__(self, rez, node):
+        self.rez = rez
+        self.node = node
+
+    def details(self):
+        return set(), {self.node.width.var, self.node.height.var}
+
+    def solve(self, fixed):
+        return {
+            self.node.width.var: self.rez.width,
+            self.node.height.var: self.rez.height,
+        }
+
+ROW = """
+& {tag} {{
+  x;y=* {{ H: (x)(y) }}
+  x=*:first {{ H: Edge(x) }}
+  x=*:last  {{ H: (x)Edge }}
+  x=* {{ Dim a: V: Edge-a-(x)-a-Edge @0 a = 0 }}
+}}
+"""
+
+COLUMN = """
+& {tag} {{
+  x;y=* {{ V: (x)(y) }}
+  x=*:first {{ V: Edge(x) }}
+  x=*:last  {{ V: (x)Edge }}
+  x=* {{ Dim a: H: Edge-a-(x)-a-Edge @0 a = 0 }}
+}}
+"""
+
+# The stylesheet of demo.py.
+SHEET = """
+x=* { Dim !a: H: Edge-a-(*)-a-Edge @0 a >= 0 }
+x=* { Dim !a: V: Edge-a-(*)-a-Edge @0 a >= 0 }
+""" + ROW.format(tag="row") + COLUMN.format(tag="column") + """
+& paragraph {
+  @ ().width = 200
+  layout("knuth-plass")
+}
+"""
+
+def document(children, width=1280, height=640):
+    return Node(
+        nudgeteer = Resizer(width, height),
+        children = children,
+        left = promote(0),
+        top = promote(0),
+        width = slack(),
+        height = slack(),
+    )
+
+def leaf(rnd):
+    return Node(width = promote(rnd.randint(10, 80)),
+                height = promote(rnd.randint(10, 40)))
+
+def deep(depth, seed=0):
+    """
+    Rows and columns nested depth levels deep,
+    with two leaves beside each nested container.
+    A selector stops at the outermost node it matches,
+    so every level has its own tag and rules.
+    """
+    rnd = random.Random(seed)
+    node = leaf(rnd)
+    rules = [SHEET]
+    for i in range(depth):
+        tag = f"level{i}"
+        rules.append((ROW if i % 2 == 0 else COLUMN).format(tag=tag))
+        node = Node(children=[leaf(rnd), node, leaf(rnd)], tag=tag)
+    return document([node]), "".join(rules)
+
+def wide(width, seed=0):
+    """
+    One row of width leaves.
+    """
+    rnd = random.Random(seed)
+    row = Node(children=[leaf(rnd) for _ in range(width)], tag="row")
+    return document([row]), SHEET
+
+def paragraphs(count, words=20, seed=0):
+    """
+    A column of count paragraphs of words boxes,
+    each broken into lines by knuth-plass.
+    """
+    rnd = random.Random(seed)
+    column = Node(children=[
+        Node(children=[leaf(rnd) for _ in range(words)], tag="paragraph")
+        for _ in range(count)
+    ], tag="column")
+    return document([column]), SHEET
+
+def strengths(count, levels=4, seed=0):
+    """
+    A row of count boxes with flexible sizes, pulled towards
+    different widths and heights at levels strengths.
+    """
+    rnd = random.Random(seed)
+    row = Node(children=[Node() for _ in range(count)], tag="row")
+    rules = [SHEET, "& row {"]
+    for k in range(1, levels + 1):
+        rules.append(f"  x=* {{ @{k} x.width = {rnd.randint(20, 120)} }}")
+        rules.append(f"  x=* {{ @{k} x.height >= {rnd.randint(10, 60)} }}")
+    rules.append("}")
+    return document([row]), "\n".join(rules)
+
+def selectors(count, rules, fanout=8, seed=0):
+    """
+    A tree of count nodes with rules tags and a stylesheet of
+    rules blocks, one per tag. Most of the tree matches no rule,
+    so resolving is dominated by finding the matches.
+    """
+    rnd = random.Random(seed)
+    nodes = [Node(tag="column")]
+    for i in range(1, count):
+        parent = nodes[(i - 1) // fanout]
+        node = leaf(rnd)
+        node.tag = f"t{rnd.randrange(rules * 10)}"
+        parent.append(node)
+        nodes.append(node)
+    sheet = [SHEET]
+    for k in range(rules):
+        sheet.append(f"& t{k} {{ x=* {{ @2 x.width >= {rnd.randint(5, 40)} }} }}")
+    return document([nodes[0]]), "\n".join(sheet)
+
+def resizes(count, seed=0):
+    """
+    Window sizes for a sequence of resizes.
+    """
+    rnd = random.Random(seed)
+    return [(rnd.randint(600, 2000), rnd.randint(400, 1200)) for _ in range(count)]
@@ -0,0 +1,108 @@
+"""
+Time the phases of laying out the synthetic documents in
+benchmarks.generators: stylesheet.parse, resolving the stylesheet,
+cold and warm results(), and the refines of a resize sequence.
+Peak memory is measured in a second pass with tracemalloc, so
+that it does not slow down the timings.
+
+    python -m benchmarks.run [--quick] [--json FILE] [CASE ...]
+
+--json writes the results as JSON, '-' for stdout.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from xylem.cascade import System
+from xylem.stylesheet import parse
+from . import generators
+
+CASES = {
+    "deep":       lambda quick: generators.deep(8 if quick else 40),
+    "wide":       lambda quick: generators.wide(50 if quick else 1000),
+    "paragraphs": lambda quick: generators.paragraphs(20 if quick else 500),
+    "strengths":  lambda quick: generators.strengths(20 if quick else 300),
+    "selectors":  lambda quick: generators.selectors(*((2000, 20) if quick else (100000, 200))),
+}
+
+def layout(root, sheet):
+    system = System()
+    system.add_node(root)
+    parse(sheet).resolve(system, (), root)
+    return system.results()
+
+def bench(name, make, quick):
+    root, sheet = make(quick)
+    out = {"case": name}
+
+    start = time.perf_counter()
+    ruleset = parse(sheet)
+    out["parse"] = time.perf_counter() - start
+
+    system = System()
+    system.add_node(root)
+    start = time.perf_counter()
+    ruleset.resolve(system, (), root)
+    out["resolve"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = system.results()
+    out["cold"] = time.perf_counter() - start
+    out["variables"] = len(results)
+
+    start = time.perf_counter()
+    system.results()
+    out["warm"] = time.perf_counter() - start
+
+    times = []
+    for width, height in generators.resizes(5 if quick else 20):
+        root.nudgeteer.width = width
+        root.nudgeteer.height = height
+        start = time.perf_counter()
+        system.results()
+        times.append(time.perf_counter() - start)
+    out["resize_mean"] = statistics.mean(times)
+    out["resize_max"] = max(times)
+
+    root, sheet = make(quick)
+    tracemalloc.start()
+    try:
+        layout(root, sheet)
+        out["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return out
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cases", nargs="*", metavar="CASE",
+                        help="one of " + ", ".join(CASES))
+    parser.add_argument("--quick", action="store_true", help="small documents")
+    parser.add_argument("--json", metavar="FILE", help="write results as JSON")
+    args = parser.parse_args(argv)
+    for name in args.cases:
+        if name not in CASES:
+            parser.error(f"unknown case {name!r}")
+
+    results = []
+    for name in args.cases or CASES:
+        out = bench(name, CASES[name], args.quick)
+        results.append(out)
+        print(f"{name:12} vars {out['variables']:7} "
+              f"parse {out['parse']*1000:8.1f}ms "
+              f"resolve {out['resolve']*1000:8.1f}ms "
+              f"cold {out['cold']*1000:8.1f}ms "
+              f"warm {out['warm']*1000:7.2f}ms "
+              f"resize {out['resize_mean']*1000:7.2f}ms "
+              f"peak {out['peak_memory']/2**20:7.1f}MiB", file=sys.stderr)
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+if __name__ == "__main__":
+    main()
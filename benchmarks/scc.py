@@ -0,0 +1,93 @@
+"""
+Timing of the component pass that cascade.System.compile() runs,
+on graphs shaped like its plans: groups feeding layout solvers
+feeding groups. The deep case also times compile() itself on a
+node tree nested as deep.
+
+    python -m benchmarks.scc [LEVELS] [SOLVERS]
+"""
+import argparse
+import time
+from xylem.cascade import System, tarjans_scc, wavefronts
+from xylem.constrainer import ge
+from xylem.nodes import Node
+
+def deep(levels):
+    # A node nested in a node, and so on: every level
+    # is a group laid out by a solver from the level above.
+    graph = {}
+    for i in range(levels):
+        graph[("group", i)] = {("solver", i)}
+        graph[("solver", i)] = {("group", i + 1)}
+    graph[("group", levels)] = set()
+    return graph
+
+class Nest:
+    # Lays out the width of the only child of a node from its own.
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        child, = self.node.children
+        return set(self.node.width.coeffs), {child.width.var}
+
+    def solve(self, fixed):
+        child, = self.node.children
+        return {child.width.var: self.node.width.eval(fixed)}
+
+def tree(levels):
+    # deep() as a System: every node is nested in the one above,
+    # and its width is a group laid out by the solver above.
+    node = Node()
+    nodes = [node]
+    for i in range(levels):
+        node = Node(children=[node], nudgeteer=Nest)
+        nodes.append(node)
+    system = System()
+    system.add_node(node)
+    for node in nodes:
+        system.add_constraint(ge(node.width))
+    return system
+
+def wide(solvers):
+    # One container with a great number of children,
+    # each laid out by its own solver into its own group.
+    root = ("group", -1)
+    graph = {root: set()}
+    for i in range(solvers):
+        graph[root].add(("solver", i))
+        graph[("solver", i)] = {("group", i)}
+        graph[("group", i)] = set()
+    return graph
+
+def bench(name, graph):
+    start = time.perf_counter()
+    comps = tarjans_scc(graph)
+    mid = time.perf_counter()
+    levels = wavefronts(graph)
+    end = time.perf_counter()
+    print(f"{name}: {len(graph)} vertices, {len(comps)} components, "
+          f"{len(levels)} levels, "
+          f"tarjans_scc {(mid - start)*1000:.1f}ms, "
+          f"wavefronts {(end - mid)*1000:.1f}ms")
+
+def bench_compile(name, system):
+    start = time.perf_counter()
+    plan = system.compile()
+    end = time.perf_counter()
+    print(f"{name}: {len(plan.order)} components, "
+          f"compile {(end - start)*1000:.1f}ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("levels", nargs="?", type=int, default=10000,
+                        help="depth of the deep case (default 10000)")
+    parser.add_argument("solvers", nargs="?", type=int, default=1000000,
+                        help="solvers in the wide case (default 1000000)")
+    args = parser.parse_args(argv)
+    bench(f"deep {args.levels}", deep(args.levels))
+    bench_compile(f"deep {args.levels} nodes", tree(args.levels))
+    bench(f"wide {args.solvers}", wide(args.solvers))
+
+if __name__ == "__main__":
+    main()
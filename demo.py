@@ -1,5 +1,5 @@
 import pygame
-from xylem.cascade import System
+from xylem.cascade import System, Relayout
 from xylem.nodes import *
 from xylem.stylesheet import parse
 
@@ -135,7 +135,15 @@ x=* { Dim !a: V: Edge-a-(*)-a-Edge @0 a >= 0 }
 
 ruleset.resolve(system, (), root)
 
-results = system.results()
+# Layout runs on a background thread, and drawing uses
+# the latest results it has finished.
+relayout = Relayout(system)
+relayout.request()
+results = relayout.wait()
+
+def resize(width, height):
+    root.nudgeteer.width = width
+    root.nudgeteer.height = height
 
 def draw(screen, node, results, x, y):
     x += node.left.eval(results)
@@ -159,14 +167,14 @@ clock = pygame.time.Clock()
 while True:
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
+            relayout.close()
             pygame.quit()
             raise SystemExit
         if event.type == pygame.VIDEORESIZE:
             SCREEN_WIDTH, SCREEN_HEIGHT = event.size
-            root.nudgeteer.width = SCREEN_WIDTH
-            root.nudgeteer.height = SCREEN_HEIGHT
-            results = system.results()
+            relayout.request(lambda w=SCREEN_WIDTH, h=SCREEN_HEIGHT: resize(w, h))
 
+    results = relayout.results
     screen.fill((30,30,30))
     draw(screen, root, results, 0, 0)
 
@@ -0,0 +1,333 @@
+import pytest
+from xylem import knuthplass
+from xylem.cascade import System, Stats
+from xylem.constrainer import promote, slack
+from xylem.nodes import Node
+from xylem.stylesheet import parse
+
+ROW = parse("""
+x;y=* { H: (x)(y) }
+x=*:first { H: Edge(x) }
+x=*:last  { H: (x)Edge }
+%c { @ ().width = 100 }
+""")
+
+def row():
+    children = [Node(name="a"), Node(name="b"), Node(name="c")]
+    root = Node(children=children, left=promote(0), top=promote(0),
+                width=promote(400), height=promote(300))
+    return root, children
+
+def widths(nodes, results):
+    return [node.width.eval(results) for node in nodes]
+
+def test_discard_declaration():
+    root, children = row()
+    strong = parse("%a { @1 ().width = 100 }")
+    weak = parse("%a { @2 ().width = 200 }")
+    system = System()
+    system.add_node(root)
+    for declaration in (ROW, strong, weak):
+        system.add_declaration(declaration, root)
+    assert widths(children, system.results()) == [100, 200, 100]
+
+    system.discard_declaration(strong)
+    assert widths(children, system.results()) == [200, 100, 100]
+
+    fresh, fresh_children = row()
+    cold = System()
+    cold.add_node(fresh)
+    for declaration in (ROW, weak):
+        cold.add_declaration(declaration, fresh)
+    assert widths(fresh_children, cold.results()) == [200, 100, 100]
+
+def test_discard_declaration_restores_the_rest():
+    root, children = row()
+    extra = parse("%b { @ ().width = 120 }")
+    system = System()
+    system.add_node(root)
+    system.add_declaration(ROW, root)
+    system.add_declaration(extra, root)
+    assert widths(children, system.results()) == [180, 120, 100]
+    system.discard_declaration(extra)
+    system.add_declaration(parse("%b { @ ().width = 60 }"), root)
+    assert widths(children, system.results()) == [240, 60, 100]
+
+PARAGRAPH = parse("""
+* { @ ().width = 200 @3 ().height = 300 }
+%p %w { @ ().width = 40 @ ().height = 20 }
+""")
+KNUTH_PLASS = parse('%p { layout("knuth-plass") }')
+
+def paragraph():
+    words = [Node(name="w") for _ in range(12)]
+    para = Node(children=words, name="p")
+    root = Node(children=[para], left=promote(0), top=promote(0),
+                width=promote(400), height=promote(300))
+    return root, para
+
+def cold_height(*declarations):
+    root, para = paragraph()
+    system = System()
+    system.add_node(root)
+    for declaration in declarations:
+        system.add_declaration(declaration, root)
+    return para.height.eval(system.results())
+
+def test_discard_layout():
+    # The heights the layout fixed into the tableau are released.
+    root, para = paragraph()
+    system = System()
+    system.add_node(root)
+    system.add_declaration(PARAGRAPH, root)
+    system.add_declaration(KNUTH_PLASS, root)
+    assert para.height.eval(system.results()) == cold_height(PARAGRAPH, KNUTH_PLASS)
+    system.discard_declaration(KNUTH_PLASS)
+    assert para.height.eval(system.results()) == cold_height(PARAGRAPH) == 300
+
+class Nothing:
+    # A layout that gives no values.
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        return set(), set()
+
+    def solve(self, fixed):
+        return {}
+
+def test_replace_layout():
+    root, para = paragraph()
+    system = System({"knuth-plass": knuthplass.Solver, "nothing": Nothing})
+    system.add_node(root)
+    system.add_declaration(PARAGRAPH, root)
+    system.add_declaration(KNUTH_PLASS, root)
+    assert para.height.eval(system.results()) == cold_height(PARAGRAPH, KNUTH_PLASS)
+    system.add_declaration(parse('%p { layout("nothing") }'), root)
+    assert para.height.eval(system.results()) == cold_height(PARAGRAPH) == 300
+
+class Column:
+    # Stacks the children of a node, recording the nodes it solves.
+    solved = []
+
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        consumes = set(self.node.width.coeffs)
+        produces = set()
+        for child in self.node.children:
+            consumes.update(child.height.coeffs)
+            produces.update((child.left.var, child.top.var))
+        return consumes, produces
+
+    def solve(self, fixed):
+        Column.solved.append(self.node.name)
+        y = 0.0
+        out = {}
+        for child in self.node.children:
+            out[child.left.var] = 0.0
+            out[child.top.var] = y
+            y += child.height.eval(fixed)
+        return out
+
+class Resize:
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        return set(), {self.node.width.var}
+
+    def solve(self, fixed):
+        return {self.node.width.var: self.node.size}
+
+COLUMNS = parse("""
+x;y=* { H: (x)(y) }
+x=*:first { H: Edge(x) }
+x=*:last  { H: (x)Edge }
+%p | %q { layout("column") }
+%q { @1 ().width = 100 }
+%r { @2 ().width = 100 }
+%p * | %q * | %r * { @2 ().height = 20 }
+""")
+
+def columns(size, *declarations):
+    parts = [Node(name=name, children=[Node(name="x"), Node(name="y")])
+             for name in "pqr"]
+    root = Node(children=parts, nudgeteer=Resize, left=promote(0),
+                top=promote(0), width=slack(), height=promote(300))
+    root.size = size
+    system = System({"column": Column})
+    system.add_node(root)
+    for declaration in (COLUMNS, *declarations):
+        system.add_declaration(declaration, root)
+    return system, root
+
+def boxes(root, results):
+    out = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        out.append([e.eval(results) for e in (node.left, node.top, node.width, node.height)])
+        stack.extend(node.children)
+    return out
+
+def assert_cold(system, root, *declarations):
+    results = system.results()
+    fresh, fresh_root = columns(root.size, *declarations)
+    assert boxes(root, results) == boxes(fresh_root, fresh.results())
+
+def test_resize_solves_what_depends_on_it():
+    system, root = columns(400)
+    system.results()
+    Column.solved = []
+    root.size = 600
+    system.results()
+    # q and r keep their widths, so only p is laid out again.
+    assert Column.solved == ["p"]
+    Column.solved = []
+    system.results()
+    assert Column.solved == []
+    assert_cold(system, root)
+
+def test_constraints_are_not_skipped():
+    system, root = columns(400)
+    system.results()
+    taller = parse("%q %x { @1 ().height = 50 }")
+    system.add_declaration(taller, root)
+    assert_cold(system, root, taller)
+    system.discard_declaration(taller)
+    assert_cold(system, root)
+
+def test_solvers_are_not_skipped():
+    system, root = columns(400)
+    system.results()
+    stacked = parse('%r { layout("column") }')
+    system.add_declaration(stacked, root)
+    Column.solved = []
+    system.results()
+    assert Column.solved == ["r"]
+    assert_cold(system, root, stacked)
+    system.discard_declaration(stacked)
+    assert_cold(system, root)
+
+class Stack:
+    # Stacks the children of a node and gives its height.
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        consumes = set()
+        produces = {self.node.height.var}
+        for child in self.node.children:
+            consumes.update(child.height.coeffs)
+            produces.add(child.top.var)
+        return consumes, produces
+
+    def solve(self, fixed):
+        y = 0.0
+        out = {}
+        for child in self.node.children:
+            out[child.top.var] = y
+            y += child.height.eval(fixed)
+        out[self.node.height.var] = y
+        return out
+
+class BatchedStack(Stack):
+    calls = []
+
+    @staticmethod
+    def solve_many(nodes, fixed):
+        BatchedStack.calls.append(sorted(node.name for node in nodes))
+        out = {}
+        for node in nodes:
+            out.update(Stack(node).solve(fixed))
+        return out
+
+def stacks(module, *extra):
+    def leaf():
+        return Node(height=promote(10))
+    a = Node(name="a", children=[Node(name="a1", children=[leaf(), leaf()]),
+                                 Node(name="a2", children=[leaf()])])
+    b = Node(name="b", children=[leaf(), leaf(), leaf()])
+    root = Node(children=[a, b, *extra], left=promote(0), top=promote(0),
+                width=promote(400), height=promote(300))
+    system = System({"stack": module})
+    system.add_node(root)
+    system.add_declaration(parse('%a | %a %a1 | %a %a2 | %b { layout("stack") }'), root)
+    return system, root
+
+def test_batches():
+    system, root = stacks(BatchedStack)
+    BatchedStack.calls = []
+    results = system.results()
+    # One call for each wavefront of solvers.
+    assert BatchedStack.calls == [["a1", "a2", "b"], ["a"]]
+    fresh, fresh_root = stacks(Stack)
+    assert boxes(root, results) == boxes(fresh_root, fresh.results())
+    assert system.converged
+
+def test_batch_missing_inputs():
+    # Nothing gives the heights of the children of c.
+    c = Node(name="c", children=[Node(), Node()])
+    system, root = stacks(BatchedStack, c)
+    system.add_declaration(parse('%c { layout("stack") }'), root)
+    system.stats = Stats()
+    system.results()
+    assert not system.converged
+    assert system.stats.runs[-1]["missing"] == 1
+
+class Follow:
+    # Gives the width of another node from the width of its node.
+    # Two of them following each other form a cycle.
+    scale = 0.5
+
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        return set(self.node.width.coeffs), {self.node.other.width.var}
+
+    def solve(self, fixed):
+        return {self.node.other.width.var: self.node.width.eval(fixed)*self.scale + 1}
+
+class Diverging(Follow):
+    scale = 1.0
+
+def follow(nudgeteer):
+    a = Node(name="a", nudgeteer=nudgeteer)
+    b = Node(name="b", nudgeteer=nudgeteer)
+    a.other, b.other = b, a
+    root = Node(children=[a, b], left=promote(0), top=promote(0),
+                width=promote(400), height=promote(300))
+    system = System()
+    system.add_node(root)
+    system.add_declaration(parse("%a { @3 ().width = 5 }"), root)
+    system.stats = Stats()
+    return system, a, b
+
+def test_fixed_point_converges():
+    system, a, b = follow(Follow)
+    results = system.results()
+    assert system.converged
+    assert a.width.eval(results) == pytest.approx(2.0)
+    assert b.width.eval(results) == pytest.approx(2.0)
+
+def test_fixed_point_cap():
+    system, a, b = follow(Diverging)
+    system.max_iterations = 10
+    system.results()
+    assert not system.converged
+    component = system.stats.runs[-1]["components"][-1]
+    assert component["iterations"] == 10
+    assert not component["converged"]
+
+def test_fixed_point_missing_inputs():
+    system, a, b = follow(Follow)
+    # Nothing gives the width of c.
+    c = Node(nudgeteer=Follow)
+    c.other = Node()
+    system.add_node(Node(children=[c, c.other]))
+    system.results()
+    assert not system.converged
+    assert system.stats.runs[-1]["missing"] == 1
@@ -0,0 +1,189 @@
+"""
+Removal from a constrainer.System, checked against a cold solve
+of the constraints that remain. These systems have alternative
+optima, so solutions are compared by their objective value at
+every strength, and by whether every constraint holds.
+"""
+import random
+import pytest
+from xylem.constrainer import System, flex, eq, le, ge, les, ges
+
+STRENGTHS = range(4)
+SEEDS = range(100)
+
+def random_constraints(rnd, xs):
+    cs = []
+    for x in xs:
+        cs.append(ge(x))
+        cs.append(le(x - 1000))
+    for _ in range(2*len(xs)):
+        a, b = rnd.sample(xs, 2)
+        kind = rnd.choice([eq, le, ge, les, ges])
+        if kind in (eq, les, ges):
+            strength = rnd.choice(STRENGTHS)
+        else:
+            strength = rnd.choice([None, *STRENGTHS])
+        cs.append(kind(a - b - rnd.randint(-50, 50), strength))
+    for x in xs:
+        cs.append(eq(x - rnd.randint(0, 1000), 3))
+    return cs
+
+def objective_values(cs, results):
+    total = dict.fromkeys(STRENGTHS, 0.0)
+    for c in cs:
+        for s, o in c.objective.items():
+            total[s] += o.eval(results)
+    return [total[s] for s in STRENGTHS]
+
+def cold(cs, fixed=None):
+    system = System(fixed)
+    system.add_many(cs)
+    return system.results()
+
+def assert_same_optimum(cs, results, expected):
+    assert objective_values(cs, results) == pytest.approx(
+        objective_values(cs, expected), abs=1e-6)
+    for c in cs:
+        assert c.expr.eval(results) == pytest.approx(0.0, abs=1e-6)
+
+def satisfiable(seed, count=8):
+    # A random system, or None when it has no solution.
+    rnd = random.Random(seed)
+    xs = [flex() for _ in range(count)]
+    cs = random_constraints(rnd, xs)
+    try:
+        cold(cs)
+    except Exception:
+        return None
+    return rnd, xs, cs
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_discard(seed):
+    case = satisfiable(seed)
+    if case is None:
+        pytest.skip("unsatisfiable")
+    rnd, xs, cs = case
+    system = System()
+    for c in cs:
+        system.add(c)
+    system.results()
+    removed = rnd.sample(cs, len(cs)//3)
+    for c in removed:
+        system.discard(c)
+    rest = [c for c in cs if c not in removed]
+    assert_same_optimum(rest, system.results(), cold(rest))
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_discard_many(seed):
+    case = satisfiable(seed)
+    if case is None:
+        pytest.skip("unsatisfiable")
+    rnd, xs, cs = case
+    system = System()
+    system.add_many(cs)
+    system.results()
+    removed = rnd.sample(cs, len(cs)//3)
+    system.discard_many(removed)
+    rest = [c for c in cs if c not in removed]
+    assert_same_optimum(rest, system.results(), cold(rest))
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_discard_presolved(seed):
+    # Trivial equalities are presolved into aliases by add_many,
+    # and discarding one rebuilds the tableau without them.
+    case = satisfiable(seed)
+    if case is None:
+        pytest.skip("unsatisfiable")
+    rnd, xs, cs = case
+    trivial = [eq(xs[0] - xs[1] - 5), eq(xs[2] - 300)]
+    try:
+        cold(cs + trivial)
+    except Exception:
+        pytest.skip("unsatisfiable")
+    system = System()
+    system.add_many(cs + trivial)
+    assert system.presolved
+    system.results()
+    system.discard(trivial[0])
+    assert_same_optimum(cs + trivial[1:], system.results(), cold(cs + trivial[1:]))
+    system.discard(trivial[1])
+    assert_same_optimum(cs, system.results(), cold(cs))
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_reset(seed):
+    case = satisfiable(seed)
+    if case is None:
+        pytest.skip("unsatisfiable")
+    rnd, xs, cs = case
+    system = System()
+    system.add_many(cs)
+    results = system.results()
+    system.refine({xs[3].var: xs[3].eval(results),
+                   xs[1].var: xs[1].eval(results)})
+    system.results()
+    system.reset()
+    assert_same_optimum(cs, system.results(), cold(cs))
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_merge(seed):
+    case = satisfiable(seed)
+    other = satisfiable(seed + len(SEEDS))
+    if case is None or other is None:
+        pytest.skip("unsatisfiable")
+    cs, ds = case[2], other[2]
+    a = System()
+    a.add_many(cs)
+    a.results()
+    b = System()
+    b.add_many(ds)
+    b.results()
+    merged = a.merge(b)
+    assert_same_optimum(cs + ds, merged.results(), {**cold(cs), **cold(ds)})
+    removed = cs[::3] + ds[::3]
+    merged.discard_many(removed)
+    rest = [c for c in cs + ds if c not in removed]
+    assert_same_optimum(rest, merged.results(), cold(rest))
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_remove_edit_var(seed):
+    case = satisfiable(seed)
+    if case is None:
+        pytest.skip("unsatisfiable")
+    rnd, xs, cs = case
+    system = System()
+    system.add_many(cs)
+    system.add_edit_var(xs[4].var, 0)
+    system.suggest_value(xs[4].var, 321)
+    edited = cs + [eq(xs[4] - 321, 0)]
+    assert_same_optimum(cs, system.results(), cold(edited))
+    system.remove_edit_var(xs[4].var)
+    assert not system.edits
+    assert_same_optimum(cs, system.results(), cold(cs))
+
+def test_suggest_value():
+    x, y = flex(), flex()
+    system = System()
+    system.add_many([ge(x - 10), le(x - 100), eq(y - x - 5), eq(x - 40, 3)])
+    with pytest.raises(ValueError):
+        system.add_edit_var(x.var, None)
+    assert not system.edits
+    # The edit starts where x already is.
+    system.add_edit_var(x.var, 0)
+    assert x.eval(system.results()) == pytest.approx(40)
+    for value, expected in [(50, 50), (500, 100), (5, 10), (70, 70)]:
+        system.suggest_value(x.var, value)
+        results = system.results()
+        assert x.eval(results) == pytest.approx(expected)
+        assert y.eval(results) == pytest.approx(expected + 5)
+    system.remove_edit_var(x.var)
+    assert x.eval(system.results()) == pytest.approx(40)
+
+def test_add_unsatisfiable():
+    x = flex()
+    system = System()
+    system.add_many([ge(x - 10), le(x - 100)])
+    c = eq(x)
+    with pytest.raises(Exception, match="unsatisfiable"):
+        system.add(c)
+    assert c not in system.constraints
+    assert 10 - 1e-6 <= x.eval(system.results()) <= 100 + 1e-6
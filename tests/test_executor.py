@@ -0,0 +1,87 @@
+import concurrent.futures
+import pytest
+from xylem.cascade import System, Stats
+from xylem.constrainer import promote, slack
+from xylem.nodes import Node
+from xylem.stylesheet import parse
+
+SHEET = parse("""
+x;y=* { H: (x)(y) }
+x=*:first { H: Edge(x) }
+x=*:last  { H: (x)Edge }
+%a | %b | %c { layout("knuth-plass") }
+%a { @1 ().width = 300 }
+%b { @1 ().width = 200 }
+%a | %b | %c { @ %end.top >= 0 }
+""")
+# Only fits while the last paragraph is wide enough for one line.
+ONE_LINE = parse("%c { @ %end.top <= 0 }")
+
+class Resize:
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        return set(), {self.node.width.var}
+
+    def solve(self, fixed):
+        return {self.node.width.var: self.node.width_value}
+
+def build(*declarations):
+    paragraphs = [Node(name=name, children=[Node(name=word, width=promote(40),
+                                                 height=promote(20))
+                                            for word in ["w"]*7 + ["end"]])
+                  for name in "abc"]
+    root = Node(children=paragraphs, nudgeteer=Resize, left=promote(0),
+                top=promote(0), width=slack(), height=promote(600))
+    root.width_value = 900
+    system = System()
+    system.add_node(root)
+    for declaration in (SHEET, *declarations):
+        system.add_declaration(declaration, root)
+    return system, root
+
+def layout(root, results):
+    out = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        out.append([e.eval(results) for e in (node.left, node.top, node.width, node.height)])
+        stack.extend(node.children)
+    return out
+
+def resizes(system, root, widths):
+    for width in widths:
+        root.width_value = width
+        yield layout(root, system.results())
+
+WIDTHS = [900, 600, 900, 1200, 450]
+
+@pytest.fixture(params=["thread", "process"])
+def executor(request):
+    if request.param == "thread":
+        pool = concurrent.futures.ThreadPoolExecutor(4)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(2)
+    with pool:
+        yield pool
+
+def test_executor_matches_sequential(executor):
+    system, root = build()
+    system.executor = executor
+    system.stats = Stats()
+    sequential, fresh = build()
+    assert list(resizes(system, root, WIDTHS)) == list(resizes(sequential, fresh, WIDTHS))
+    # Cached tableaux are solved by the executor too, not only cold builds.
+    assert all(run["offloaded"] for run in system.stats.runs)
+
+def test_executor_raises_errors(executor):
+    system, root = build(ONE_LINE)
+    system.executor = executor
+    sequential, fresh = build(ONE_LINE)
+    assert list(resizes(system, root, [900])) == list(resizes(sequential, fresh, [900]))
+    for s, r in ((system, root), (sequential, fresh)):
+        with pytest.raises(Exception, match="unsatisfiable|Infeasible"):
+            list(resizes(s, r, [600]))
+    # The tableaux left behind by the error still give the same layout.
+    assert list(resizes(system, root, [900, 1200])) == list(resizes(sequential, fresh, [900, 1200]))
@@ -0,0 +1,79 @@
+import operator
+from xylem.constrainer import Results
+from xylem.nodes import (
+    Node, Root, Some, Child, AnyChild, First, Last,
+    Arg, Self, Number, Parameter, Op)
+
+def tree():
+    a = Node(name="a", tag="p", children=[Node(name="a1", tag="p"), Node(name="a2")])
+    b = Node(name="b")
+    c = Node(name="c", tag="p")
+    return Node(children=[a, b, c])
+
+def names(selector, root):
+    return [node.name for node in selector.match(root)]
+
+FIRST = First(AnyChild(Root()))
+LAST = Last(AnyChild(Root()))
+
+def test_matches_follow_edits():
+    root = tree()
+    a, b, c = root.children
+    assert names(FIRST, root) == ["a"]
+    assert names(LAST, root) == ["c"]
+    assert names(Some("p"), root) == ["a", "c"]
+    assert names(Child(Root(), "p"), root) == ["a", "c"]
+
+    root.append(Node(name="d", tag="p"))
+    assert names(LAST, root) == ["d"]
+    assert names(Child(Root(), "p"), root) == ["a", "c", "d"]
+
+    root.insert(0, Node(name="e"))
+    assert names(FIRST, root) == ["e"]
+    assert names(AnyChild(Root()), root) == ["e", "a", "b", "c", "d"]
+
+    root.remove(a)
+    assert a.parent is None
+    assert names(Some("p"), root) == ["c", "d"]
+    assert names(Some("p", hashed=True), root) == []
+    # The removed subtree is a tree of its own.
+    assert names(Some("p"), a) == ["a", "a1"]
+    assert names(Last(Root()), a) == ["a"]
+    assert names(LAST, a) == ["a2"]
+
+def test_moving_a_subtree():
+    root = tree()
+    other = Node(children=[Node(name="x")])
+    a = root.children[0]
+    names(Some("p"), other)
+    root.remove(a)
+    other.children[0].insert(0, a)
+    assert names(Some("p"), root) == ["c"]
+    assert names(Some("p"), other) == ["a"]
+    assert names(First(Some("p")), other) == ["a"]
+    assert names(Child(Some("x", hashed=True), "a", hashed=True), other) == ["a"]
+
+def test_relative_to():
+    root = tree()
+    a, b, c = root.children
+    nodes = [c, a.children[1], b, a, a.children[0]]
+    # Positions among siblings, from the node up.
+    nodes.sort(key=root.relative_to())
+    assert [node.name for node in nodes] == ["a", "a1", "b", "a2", "c"]
+    assert root.relative_to()(a.children[1]) == [1, 0]
+    root.insert(0, Node(name="d"))
+    assert root.relative_to()(a.children[1]) == [1, 1]
+
+def test_expression_eval():
+    root = tree()
+    a = root.children[0]
+    a1 = a.children[0]
+    assert Arg(0).eval([a, a1], root) is a1
+    assert Arg(1).eval((a, a1), root) is a
+    assert Self().eval([], root) is root
+    assert Op(operator.mul, [Number(2), Number(3)]).eval([], root) == 6
+    # Positions come out relative to the node resolved in.
+    expr = Op(operator.add, [Parameter(Arg(0), "left"), Parameter(Self(), "width")])
+    results = Results({a.left.var: 10.0, a1.left.var: 5.0, a.width.var: 7.0})
+    assert expr.eval([a1], a).eval(results) == 12.0
+    assert expr.eval([a1], root).eval(results) == 15.0 + root.width.eval(results)
@@ -0,0 +1,21 @@
+import pytest
+from xylem.cascade import System, Relayout
+from xylem.constrainer import promote
+from xylem.nodes import Node
+from xylem.stylesheet import parse
+
+def test_close_releases_the_system():
+    child = Node()
+    root = Node(children=[child], left=promote(0), top=promote(0),
+                width=promote(400), height=promote(300))
+    system = System()
+    system.add_node(root)
+    system.add_declaration(parse("* { @ ().width = 100 }"), root)
+    relayout = Relayout(system)
+    relayout.request()
+    assert child.width.eval(relayout.wait()) == 100
+    relayout.close()
+    assert system.interrupt is None
+    with pytest.raises(RuntimeError):
+        relayout.request()
+    assert child.width.eval(system.results()) == 100
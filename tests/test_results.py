@@ -0,0 +1,76 @@
+import pytest
+from xylem.constrainer import Results, LinearExpr, flex
+
+def variables(count):
+    return [flex().var for _ in range(count)]
+
+def test_reserve_grows_downward():
+    xs = variables(1000)
+    results = Results()
+    copies = 0
+    data = results.data
+    for i, x in reversed(list(enumerate(xs))):
+        results[x] = float(i)
+        if results.data is not data:
+            copies += 1
+            data = results.data
+        assert results.base >= 0
+    # The span at least doubles each time it grows towards lower indices.
+    assert copies <= 12
+    assert len(results) == 1000
+    assert dict(results) == {x: float(i) for i, x in enumerate(xs)}
+
+def test_reserve_stops_at_zero():
+    xs = variables(4)
+    results = Results()
+    results[xs[3]] = 3.0
+    results._reserve_(0, 0)
+    assert results.base == 0
+    assert len(results.present) == xs[3].index + 1
+    assert dict(results) == {xs[3]: 3.0}
+
+def test_assign_tolerance():
+    x, y, z = variables(3)
+    results = Results()
+    assert results.assign({x: 1.0, y: 2.0}) == [x, y]
+    changed = results.assign({x: 1.0 + 1e-12, y: 2.5, z: 0.0}, 1e-9)
+    assert changed == [y, z]
+    # Values within the tolerance are still stored.
+    assert results[x] == 1.0 + 1e-12
+    assert results.assign({}) == []
+    assert len(results) == 3
+
+def test_take():
+    x, y, z = variables(3)
+    other = Results({x: 1.0, y: 2.0})
+    results = Results({z: 3.0})
+    results.take(other, [x, z])
+    assert dict(results) == {x: 1.0, z: 3.0}
+    assert len(results) == 2
+    results.take(other, [])
+    assert len(results) == 2
+
+def test_delitem():
+    x, y = variables(2)
+    results = Results({x: 1.0, y: 2.0})
+    del results[x]
+    assert x not in results
+    assert results.get(x, -1.0) == -1.0
+    assert len(results) == 1
+    assert list(results) == [y]
+    with pytest.raises(KeyError):
+        del results[x]
+    with pytest.raises(KeyError):
+        results[x]
+    results[x] = 4.0
+    assert len(results) == 2
+    assert results[x] == 4.0
+
+def test_eval_out_of_range():
+    a, b, c = variables(3)
+    results = Results({b: 10.0})
+    # Variables outside the stored span count as 0.
+    expr = LinearExpr({a: 2.0, b: 3.0, c: 1.0}, 5.0)
+    assert results.eval(expr) == 35.0
+    assert Results().eval(expr) == 5.0
+    assert expr.eval(results) == 35.0
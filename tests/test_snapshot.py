@@ -0,0 +1,45 @@
+import json
+from xylem.cascade import System
+from xylem.constrainer import promote, slack
+from xylem.nodes import Node
+from xylem.stylesheet import parse
+
+SHEET = parse("""
+x;y=* { H: (x)(y) }
+x=*:first { H: Edge(x) }
+x=*:last  { H: (x)Edge }
+x=* { @1 x.width = 100 }
+""")
+
+class Resize:
+    def __init__(self, node):
+        self.node = node
+
+    def details(self):
+        return set(), {self.node.width.var}
+
+    def solve(self, fixed):
+        return {self.node.width.var: 250}
+
+def build():
+    children = [Node(), Node(), Node()]
+    root = Node(children=children, nudgeteer=Resize, left=promote(0),
+                top=promote(0), width=slack(), height=promote(100))
+    system = System()
+    system.add_node(root)
+    system.add_declaration(SHEET, root)
+    return system, children
+
+def test_restore_keeps_the_plan():
+    system, children = build()
+    expected = system.results()
+    data = json.loads(json.dumps(system.snapshot()))
+
+    fresh, fresh_children = build()
+    fresh.restore(data)
+    assert fresh.plan is not None
+    order = [[type(g).__name__ for g in comp] for comp in fresh.plan.order]
+    assert order == [[type(g).__name__ for g in comp] for comp in system.plan.order]
+    results = fresh.results()
+    assert ([c.width.eval(results) for c in fresh_children]
+            == [c.width.eval(expected) for c in children])
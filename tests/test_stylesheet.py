@@ -0,0 +1,19 @@
+import pytest
+from xylem.cascade import System
+from xylem.nodes import Node
+from xylem.stylesheet import parse
+
+def test_constant_errors_wait_for_a_match():
+    root = Node(children=[Node(tag="hit")])
+    system = System()
+    system.add_node(root)
+    parse("& nomatch { @1 ().width = 1/0 }").resolve(system, (), root)
+    with pytest.raises(ZeroDivisionError):
+        parse("& hit { @1 ().width = 1/0 }").resolve(system, (), root)
+
+def test_constants_fold():
+    root = Node(children=[Node(tag="hit")])
+    system = System()
+    system.add_node(root)
+    parse("& hit { @ ().width = 2*3 + 10/4 }").resolve(system, (), root)
+    assert root.children[0].width.eval(system.results()) == 8.5
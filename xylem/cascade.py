@@ -1,5 +1,10 @@
 from . import knuthplass
 from . import constrainer
+from . import trace
+import concurrent.futures
+import json
+import threading
+import time
 
 default_layouts = {
     "knuth-plass": knuthplass.Solver
@@ -11,26 +16,140 @@ class System:
         self.layout_modules = default_layouts if layout_modules is None else layout_modules
         self.layouts = {}
         self.nudgets = set()
+        # Solved tableaux kept between results() calls.
+        self.systems = {}
+        # Constraints and relations produced by each declaration
+        # given to add_declaration().
+        self.produced = {}
+        self.origin = None
+        # Assign a Stats() to collect counters for results().
+        self.stats = None
+        # Results of the last results() call, and the keys
+        # of the solvers that took part in it.
+        self.previous = constrainer.Results()
+        self.solved = frozenset()
+        # Dependency plan for results(), rebuilt after changes.
+        self.plan = None
+        # Fixed-point iteration inside cyclic components stops once no
+        # value changes by more than tolerance, or after max_iterations
+        # rounds. converged tells whether the last results() got there,
+        # and ran every solver.
+        self.tolerance = 1e-9
+        self.max_iterations = 100
+        self.converged = True
+        # A concurrent.futures executor to build groups from scratch in,
+        # while components that do not depend on them are solved.
+        self.executor = None
+        # Called between components, results() raises Interrupted
+        # when it returns true.
+        self.interrupt = None
+
+    def add_declaration(self, declaration, root):
+        outer, self.origin = self.origin, declaration
+        self.produced.setdefault(declaration, ([], []))
+        try:
+            with trace.span("add_declaration"):
+                declaration.resolve(self, (), root)
+        finally:
+            self.origin = outer
+
+    def discard_declaration(self, declaration):
+        constraints, relations = self.produced.pop(declaration, ([], []))
+        self.discard_constraints(constraints)
+        for relation in relations:
+            self.discard_relation(*relation)
 
     def add_constraint(self, constraint):
+        with trace.span("add_constraint"):
+            self._add_constraint_(constraint)
+
+    def _add_constraint_(self, constraint):
+        self.plan = None
+        if self.origin is not None:
+            self.produced[self.origin][0].append(constraint)
         group = self.connected.get(constraint.marker)
-        group.constraints.add(constraint)
+        groups = {group}
         for var in constraint.expr.coeffs:
-            self.connected.union(group, self.connected.get(var))
+            groups.add(self.connected.get(var))
         for c in constraint.objective.values():
             for var in c.coeffs:
-                self.connected.union(group, self.connected.get(var))
+                groups.add(self.connected.get(var))
+        # A solved tableau takes the constraint in place, merged with
+        # the tableaux of the groups it joins. Groups that have
+        # constraints but no tableau are built from scratch later.
+        solved = [g for g in groups if g.constraints]
+        sys = None
+        if solved and all(g in self.systems for g in solved):
+            for g in solved:
+                other = self.systems.pop(g)
+                sys = other if sys is None else sys.merge(other)
+        else:
+            for g in groups:
+                self.systems.pop(g, None)
+        for other in groups:
+            group = self.connected.union(group, other)
+        group.constraints.add(constraint)
+        if sys is not None:
+            sys.add(constraint)
+            self.systems[group] = sys
+
+    def discard_constraint(self, constraint):
+        self.discard_constraints((constraint,))
+
+    def discard_constraints(self, constraints):
+        self.plan = None
+        groups = {}
+        for constraint in constraints:
+            group = self.connected.get(constraint.marker)
+            if constraint in group.constraints:
+                group.constraints.discard(constraint)
+                groups.setdefault(group, []).append(constraint)
+        for group, discarded in groups.items():
+            sys = self.systems.get(group)
+            if sys is None:
+                continue
+            if group.constraints:
+                sys.discard_many(discarded)
+            else:
+                del self.systems[group]
 
     def add_relation(self, name, root, args):
+        self.plan = None
+        if self.origin is not None:
+            self.produced[self.origin][1].append((name, root, args))
         if name == "layout":
             layout_name, = args
-            self.layouts[root] = self.layout_modules[layout_name]
+            mod = self.layout_modules[layout_name]
+            if self.layouts.get(root, mod) is not mod:
+                self._release_layout_(root)
+            self.layouts[root] = mod
+
+    def discard_relation(self, name, root, args):
+        self.plan = None
+        if name == "layout":
+            layout_name, = args
+            if self.layouts.get(root) is self.layout_modules[layout_name]:
+                self._release_layout_(root)
+
+    def _release_layout_(self, root):
+        # The tableaux the layout gave values to have them fixed,
+        # and are built again without them.
+        g = self.layouts.pop(root)(root)
+        consumes, produces = g.details()
+        for x in produces:
+            group = self.connected.variables.get(x)
+            if group is not None:
+                self.systems.pop(self.connected.find(group), None)
 
     def add_node(self, node):
-        if node.nudgeteer is not None:
-            self.nudgets.add(node)
-        for child in node.children:
-            self.add_node(child)
+        self.plan = None
+        self.systems.clear()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.nudgeteer is not None:
+                self.nudgets.add(node)
+            stack.extend(node.children)
 
     def solvers(self):
         for node, mod in self.layouts.items():
@@ -38,28 +157,54 @@ class System:
         for node in self.nudgets:
             yield node.nudgeteer(node)
 
-    def results(self):
-        systems = {}
+    def compile(self):
+        """
+        Build the dependency plan used by results(): the solvers,
+        the groups they connect, and the strongly connected
+        components in the order they are solved.
+        """
+        if self.plan is None:
+            with trace.span("compile"):
+                self.plan = self._compile_()
+        return self.plan
+
+    def _solvers_(self):
+        # Every solver with its details, and the layout module and
+        # node of the solvers that can solve many nodes at once.
+        batched = {}
+        solvers = []
+        for node, mod in self.layouts.items():
+            g = mod(node)
+            if hasattr(mod, "solve_many"):
+                batched[g] = mod, node
+            solvers.append(g)
+        for node in self.nudgets:
+            solvers.append(node.nudgeteer(node))
+        return [(g, *g.details()) for g in solvers], batched
+
+    def _compile_(self, solvers=None, order=None):
+        # Given solvers from _solvers_() and the order of a
+        # restored plan, skips asking for details and the
+        # component pass.
+        details, batched = self._solvers_() if solvers is None else solvers
+        groups = []
         graph = {}
         marks = {}
-        covers = {}
+        produced = {}
+        keys = {}
         for group in self.connected.groups:
             if group.constraints:
-                sys = constrainer.System()
-                for c in group.constraints:
-                    sys.add(c)
-                systems[group] = sys
+                groups.append(group)
             graph[group] = set()
             marks[group] = set()
-            covers[group] = group.cover
-        
-        for g in self.solvers():
-            consumes, produces = g.details()
+
+        for g, consumes, produces in details:
             gconsumes = set(self.connected.get(x) for x in consumes)
             gproduces = set(self.connected.get(x) for x in produces)
             for src in gconsumes:
-                adj = graph[src]
-                adj.add(g)
+                # Groups of variables with no constraints are made here.
+                graph.setdefault(src, set()).add(g)
+                marks.setdefault(src, set())
             adj = graph.setdefault(g, set())
             adj.update(gproduces)
             for dst in gproduces:
@@ -67,36 +212,595 @@ class System:
                     marks[dst].update(produces & dst.cover)
                 else:
                     marks[dst] = produces & dst.cover
-                    covers[dst] = dst.cover
             marks[g] = consumes
-            covers[g] = consumes | produces
-
-        fixed = {}
-        for comp in reversed(tarjans_scc(graph)):
-            frozen = set()
-            def solver_step(old):
-                new = old.copy()
-                notdone = False
-                for g in comp:
-                    if isinstance(g, Group):
-                        if g.constraints:
-                            sys = systems[g]
-                            mrk = marks[g] | frozen
-                            notdone |= sys.refine({x: old[x] for x in mrk if x in old})
-                            new.update(sys.results())
+            produced[g] = produces
+            keys[g] = (type(g), frozenset(consumes), frozenset(produces))
+        # Components with neither constraints nor solvers have nothing to do.
+        if order is None:
+            order = [comp for level in wavefronts(graph) for comp in level
+                     if any(not isinstance(g, Group) or g.constraints for g in comp)]
+        consumers = {}
+        for g, consumes in marks.items():
+            for x in consumes:
+                consumers.setdefault(x, []).append(g)
+        producers = {}
+        for g, produces in produced.items():
+            for x in produces:
+                producers.setdefault(x, []).append(g)
+        index = {g: i for i, comp in enumerate(order) for g in comp}
+        after = []
+        before = [[] for _ in order]
+        for i, comp in enumerate(order):
+            deps = set()
+            for g in comp:
+                for x in marks[g]:
+                    for h in producers.get(x, []) + [self.connected.get(x)]:
+                        j = index.get(h, i)
+                        if j != i and j not in deps:
+                            deps.add(j)
+                            before[j].append(i)
+            after.append(deps)
+        return Plan(groups, marks, consumers, produced, keys, batched,
+                    order, after, before)
+
+    def results(self):
+        with trace.span("results"):
+            return self._results_()
+
+    def _results_(self):
+        plan = self.compile()
+        systems = {group: self.systems.get(group) for group in plan.groups}
+        # A tableau still holding the values of a solver that no
+        # longer gives them is released before it is refined.
+        for group, sys in systems.items():
+            if sys is not None and not sys.fixes_only(plan.marks[group]):
+                sys.reset()
+
+        # Tableaux that had solver inputs frozen into them
+        # during a fixed-point iteration are not reused.
+        thawed = set()
+        fixed = constrainer.Results()
+        self.converged = True
+        run = None if self.stats is None else self.stats.begin()
+        # Components start once the components they depend on are done.
+        waiting = [len(deps) for deps in plan.after]
+        ready = [i for i, n in enumerate(waiting) if n == 0]
+        futures = {}
+        def release(i):
+            for j in plan.before[i]:
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    ready.append(j)
+        try:
+            while ready or futures:
+                if self.interrupt is not None and self.interrupt():
+                    raise Interrupted()
+                # Ready solvers of one layout module are solved in one call.
+                batches = {}
+                while ready:
+                    i = ready.pop()
+                    comp = plan.order[i]
+                    if (len(comp) == 1 and comp[0] in plan.batched
+                            and not self._unchanged_(plan, comp, systems, fixed)):
+                        mod, node = plan.batched[comp[0]]
+                        batches.setdefault(mod, []).append(i)
+                        continue
+                    job = self._component_(plan, comp, systems, fixed, thawed, run)
+                    if job is None:
+                        release(i)
                     else:
-                        if all(x in old for x in marks[g]):
-                            frozen.update(marks[g])
-                            new.update(g.solve(old))
-                        else:
-                            notdone = True
-                return notdone, new
-            notdone = True
-            while notdone:
-                notdone, new = solver_step(fixed)
-                fixed.update(new)
+                        futures[job[0]] = i, job[1]
+                for mod, batch in batches.items():
+                    self._batch_(plan, mod, [plan.order[i][0] for i in batch], fixed, run)
+                    for i in batch:
+                        release(i)
+                if futures and not ready:
+                    done, _ = concurrent.futures.wait(
+                        futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        i, finish = futures[future]
+                        finish(future.result())
+                        del futures[future]
+                        release(i)
+        except BaseException:
+            # Groups still in the executor may be refined in place,
+            # wait for them and keep none of them.
+            concurrent.futures.wait(futures)
+            for i, finish in futures.values():
+                self.systems.pop(plan.order[i][0], None)
+            raise
+        if run is not None:
+            self.stats.end(run)
+        self.systems = {g: sys for g, sys in systems.items() if g not in thawed}
+        self.previous = fixed
+        self.solved = plan.solved
         return fixed
 
+    def _component_(self, plan, comp, systems, fixed, thawed, run):
+        """
+        Solve a component into fixed, or return a future for a
+        group solved by the executor, with a function that takes
+        the result of the future into fixed and systems.
+        """
+        if self._unchanged_(plan, comp, systems, fixed):
+            for g in comp:
+                outputs = g.cover if isinstance(g, Group) else plan.produced[g]
+                fixed.take(self.previous, outputs)
+            if run is not None:
+                run.skipped += 1
+            return None
+        g = comp[0]
+        if self.executor is not None and len(comp) == 1 and isinstance(g, Group):
+            return self._offload_(plan, g, systems, fixed, run)
+        if run is not None:
+            run.enter(comp, systems)
+        with trace.span("component", size=len(comp)):
+            converged = self._fixed_point_(plan, comp, systems, fixed, thawed, run)
+        self.converged &= converged
+        if run is not None:
+            run.leave(comp, systems, converged)
+        return None
+
+    def _offload_(self, plan, g, systems, fixed, run):
+        inputs = {x: fixed[x] for x in plan.marks[g] if x in fixed}
+        sys = systems[g]
+        if run is not None:
+            run.offloaded += 1
+        if sys is not None and not isinstance(
+                self.executor, concurrent.futures.ProcessPoolExecutor):
+            # Threads refine the tableau where it is.
+            def refined(results):
+                fixed.assign(results)
+            return self.executor.submit(_refine_, sys, inputs), refined
+        variables = list(g.cover)
+        def built(data):
+            systems[g] = sys = _built_(g, variables, data, fixed)
+            if run is not None:
+                sys.stats = constrainer.Stats()
+        return self.executor.submit(_build_, *_encode_(g, variables, inputs, sys)), built
+
+    def _batch_(self, plan, mod, solvers, fixed, run):
+        nodes = [plan.batched[g][1] for g in solvers
+                 if all(x in fixed for x in plan.marks[g])]
+        if len(nodes) < len(solvers):
+            self._missing_(len(solvers) - len(nodes), run)
+        if not nodes:
+            return
+        with trace.span("batch", module=getattr(mod, "__name__", str(mod)), nodes=len(nodes)):
+            self._solve_many_(mod, nodes, fixed, run)
+
+    def _missing_(self, count, run):
+        # Solvers not given all their inputs are not run,
+        # and leave the results incomplete.
+        self.converged = False
+        if run is not None:
+            run.missing += count
+
+    def _solve_many_(self, mod, nodes, fixed, run):
+        if run is None:
+            fixed.assign(mod.solve_many(nodes, fixed))
+        else:
+            start = time.perf_counter()
+            fixed.assign(mod.solve_many(nodes, fixed))
+            run.batches.append({"solvers": len(nodes),
+                                "time": time.perf_counter() - start})
+
+    def _unchanged_(self, plan, comp, systems, fixed):
+        """
+        True if the component would give its previous results:
+        its tableaux are solved and up to date, and every variable
+        it consumes has the value it had in the previous call.
+        Solvers are taken to depend only on the variables they
+        consume, except those that consume none, like nudgeteers,
+        which are always run, and those that did not take part in
+        the previous call.
+        """
+        previous = self.previous
+        for g in comp:
+            if isinstance(g, Group):
+                if g.constraints:
+                    sys = systems[g]
+                    if sys is None or sys.resolve:
+                        return False
+            elif not plan.marks[g] or plan.keys[g] not in self.solved:
+                return False
+            for x in plan.marks[g]:
+                if fixed.get(x) != previous.get(x):
+                    return False
+        return True
+
+    def _fixed_point_(self, plan, comp, systems, fixed, thawed, run):
+        """
+        Solve one strongly connected component. Every group and
+        solver runs once, then again only when a variable it
+        consumes changes by more than the tolerance. Returns False
+        if the iteration cap is reached first, or if a solver is
+        left without its inputs.
+        """
+        marks = plan.marks
+        members = set(comp)
+        frozen = set()
+        missing = set()
+        pending = dict.fromkeys(comp)
+        iterations = 0
+        while pending:
+            if iterations == self.max_iterations:
+                return False
+            iterations += 1
+            if run is not None:
+                run.iterations += 1
+            work, pending = pending, {}
+            with trace.span("round", iteration=iterations):
+                for g in work:
+                    if isinstance(g, Group):
+                        if not g.constraints:
+                            continue
+                        sys = systems[g]
+                        inputs = {x: fixed[x] for x in marks[g] | frozen if x in fixed}
+                        if not inputs.keys() <= marks[g]:
+                            thawed.add(g)
+                        if sys is None:
+                            with trace.span("build", constraints=len(g.constraints)):
+                                systems[g] = sys = constrainer.System(inputs)
+                                if run is not None:
+                                    sys.stats = constrainer.Stats()
+                                sys.add_many(g.constraints)
+                        else:
+                            with trace.span("refine", inputs=len(inputs)):
+                                sys.refine(inputs)
+                        new = sys.results()
+                    else:
+                        if not all(x in fixed for x in marks[g]):
+                            missing.add(g)
+                            continue
+                        missing.discard(g)
+                        frozen.update(marks[g])
+                        with trace.span("solve", solver=type(g).__name__):
+                            if run is None:
+                                new = g.solve(fixed)
+                            else:
+                                start = time.perf_counter()
+                                new = g.solve(fixed)
+                                run.solver_time += time.perf_counter() - start
+                    for x in fixed.assign(new, self.tolerance):
+                        for h in plan.consumers.get(x, ()):
+                            if h in members:
+                                pending[h] = None
+        if missing:
+            self._missing_(len(missing), run)
+            return False
+        return True
+
+    def snapshot(self):
+        """
+        Plain data for the solved tableaux, the dependency plan
+        and the last results. Variables are numbered in the order
+        they were created, so restore() can apply it to a system
+        built the same way over a fresh node tree, in this process
+        or another.
+        """
+        solvers = self._solvers_()
+        variables = self._variables_(solvers[0])
+        numbers = {var: i for i, var in enumerate(variables)}
+        if self.plan is None:
+            self.plan = self._compile_(solvers)
+        plan = self.plan
+        return {
+            "kinds": "".join(str(var.kind) for var in variables),
+            "systems": [sys.snapshot(numbers) for sys in self.systems.values()],
+            "plan": [[_member_(g, plan.marks.get(g), plan.produced.get(g), numbers)
+                      for g in comp] for comp in plan.order],
+            "results": [[numbers[var], v] for var, v in self.previous.items()
+                        if var in numbers],
+            # Whether the results were solved by this plan.
+            "solved": plan.solved == self.solved,
+        }
+
+    def restore(self, snapshot):
+        solvers = self._solvers_()
+        variables = self._variables_(solvers[0])
+        if snapshot["kinds"] != "".join(str(var.kind) for var in variables):
+            raise ValueError("snapshot does not match the system")
+        constraints = {}
+        for group in self.connected.groups:
+            for constraint in group.constraints:
+                constraints[constraint.marker] = constraint
+        systems = {}
+        for data in snapshot["systems"]:
+            sys = constrainer.System.restore(data, variables, constraints)
+            group = self.connected.get(next(iter(sys.constraints)).marker)
+            if group.constraints != sys.constraints:
+                raise ValueError("snapshot does not match the system")
+            systems[group] = sys
+        self.systems = systems
+        self.previous = constrainer.Results(
+            (variables[i], v) for i, v in snapshot["results"])
+        self.plan = self._restore_plan_(snapshot.get("plan"), variables, solvers)
+        if self.plan is not None and snapshot.get("solved"):
+            self.solved = self.plan.solved
+        else:
+            self.solved = frozenset()
+
+    def _restore_plan_(self, data, variables, solvers):
+        # The plan of the snapshot, or None to compile it later
+        # if its groups and solvers cannot all be told apart here.
+        if data is None:
+            return None
+        numbers = {var: i for i, var in enumerate(variables)}
+        members = {}
+        for group in self.connected.groups:
+            key = _member_(group, None, None, numbers)
+            if key[1] >= 0:
+                members[key] = group
+        for g, consumes, produces in solvers[0]:
+            key = _member_(g, consumes, produces, numbers)
+            if key in members:
+                return None
+            members[key] = g
+        try:
+            order = [[members[_key_(m)] for m in comp] for comp in data]
+        except KeyError:
+            return None
+        return self._compile_(solvers, order)
+
+    def _variables_(self, details):
+        variables = set()
+        for group in self.connected.groups:
+            for constraint in group.constraints:
+                variables.add(constraint.marker)
+                variables.update(constraint.expr.coeffs)
+                for o in constraint.objective.values():
+                    variables.update(o.coeffs)
+        for g, consumes, produces in details:
+            variables.update(consumes)
+            variables.update(produces)
+        return sorted(variables, key=lambda var: var.index)
+
+def _member_(g, consumes, produces, numbers):
+    # Names a group or solver of a plan by variable numbers: a group
+    # by the first variable it covers, a solver by its details.
+    if isinstance(g, Group):
+        known = [numbers[x] for x in g.cover if x in numbers]
+        return ("group", min(known, default=-1))
+    return ("solver", type(g).__name__,
+            tuple(sorted(numbers[x] for x in consumes)),
+            tuple(sorted(numbers[x] for x in produces)))
+
+def _key_(member):
+    # A member read back from JSON, as _member_() makes it.
+    if member[0] == "group":
+        return tuple(member)
+    kind, name, consumes, produces = member
+    return (kind, name, tuple(consumes), tuple(produces))
+
+class Interrupted(Exception):
+    pass
+
+class Relayout:
+    """
+    Runs System.results() on a background thread, so that a slow
+    relayout does not hold up drawing. results is the latest complete
+    layout. It is replaced as a whole when a newer one is done, and
+    is never changed afterwards.
+    """
+    def __init__(self, system):
+        self.system = system
+        self.results = None
+        self.error = None
+        self.updates = []
+        self.busy = False
+        self.closed = False
+        self.cond = threading.Condition()
+        self.interrupt = system.interrupt = lambda: bool(self.updates)
+        self.thread = threading.Thread(target=self._run_, daemon=True)
+        self.thread.start()
+
+    def request(self, update=None):
+        """
+        Ask for a relayout. update is called on the relayout thread
+        before solving. It is where nudgeteer inputs and other changes
+        to the system belong, so that no solve sees them half done.
+        A request interrupts the relayout in progress, and all
+        updates waiting by then are applied before the next solve.
+        """
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("relayout is closed")
+            self.updates.append(update)
+            self.cond.notify_all()
+
+    def wait(self):
+        """
+        Wait until every request has been laid out,
+        and return the results.
+        """
+        with self.cond:
+            while (self.updates or self.busy) and not self.closed:
+                self.cond.wait()
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+        return self.results
+
+    def close(self):
+        """
+        Stop the relayout thread. Updates still waiting are dropped,
+        and the system can be used directly again.
+        """
+        with self.cond:
+            self.closed = True
+            self.updates.clear()
+            self.cond.notify_all()
+        self.thread.join()
+        if self.system.interrupt is self.interrupt:
+            self.system.interrupt = None
+
+    def _run_(self):
+        while True:
+            with self.cond:
+                while not self.updates and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                updates, self.updates = self.updates, []
+                self.busy = True
+            try:
+                for update in updates:
+                    if update is not None:
+                        update()
+                results = self.system.results()
+            except Interrupted:
+                continue
+            except Exception as error:
+                with self.cond:
+                    self.error = error
+                    self.busy = False
+                    self.cond.notify_all()
+                continue
+            with self.cond:
+                self.results = results
+                self.busy = False
+                self.cond.notify_all()
+
+class Plan:
+    def __init__(self, groups, marks, consumers, produced, keys, batched,
+                 order, after, before):
+        # Groups that have constraints.
+        self.groups = groups
+        # Variables each group or solver takes from the others.
+        self.marks = marks
+        # Groups and solvers taking each variable.
+        self.consumers = consumers
+        # Variables each solver gives.
+        self.produced = produced
+        # Each solver by its type and details, which stay the same
+        # when a plan is compiled again, and the set of them.
+        self.keys = keys
+        self.solved = frozenset(keys.values())
+        # Layout module and node of the solvers that can be batched.
+        self.batched = batched
+        # Strongly connected components, dependencies first.
+        self.order = order
+        # Indices of the components each component depends on,
+        # and of the components depending on it.
+        self.after = after
+        self.before = before
+
+# Solving a group in an executor. The group is sent as plain data,
+# with its variables numbered by position in a list of its cover, so
+# that process pools work too, along with its tableau if it has one.
+# The worker returns the tableau and results in the same numbering.
+# Thread pools refine a tableau in place with _refine_() instead.
+
+def _encode_(group, variables, inputs, sys=None):
+    numbers = {var: i for i, var in enumerate(variables)}
+    def expr(e):
+        return [e.constant, [[numbers[v], w] for v, w in e.coeffs.items()]]
+    constraints = [[expr(c.expr),
+                    [[s, expr(o)] for s, o in c.objective.items()],
+                    numbers[c.marker]] for c in group.constraints]
+    return ([var.kind for var in variables], constraints,
+            [[numbers[x], v] for x, v in inputs.items()],
+            None if sys is None else sys.snapshot(numbers))
+
+def _build_(kinds, constraints, inputs, data=None):
+    variables = [constrainer.fresh(kind) for kind in kinds]
+    numbers = {var: i for i, var in enumerate(variables)}
+    def expr(e):
+        constant, coeffs = e
+        return constrainer.LinearExpr({variables[j]: w for j, w in coeffs}, constant)
+    constraints = [constrainer.Constraint(expr(e), {s: expr(o) for s, o in objective},
+                                          variables[m])
+                   for e, objective, m in constraints]
+    inputs = {variables[j]: v for j, v in inputs}
+    if data is None:
+        sys = constrainer.System(inputs)
+        sys.add_many(constraints)
+    else:
+        sys = constrainer.System.restore(data, variables,
+                                         {c.marker: c for c in constraints})
+        sys.refine(inputs)
+    results = [[numbers[var], v] for var, v in sys.results().items() if var in numbers]
+    return sys.snapshot(numbers), results
+
+def _refine_(sys, inputs):
+    sys.refine(inputs)
+    return sys.results()
+
+def _built_(group, variables, built, fixed):
+    data, results = built
+    constraints = {c.marker: c for c in group.constraints}
+    sys = constrainer.System.restore(data, variables, constraints)
+    for j, v in results:
+        fixed[variables[j]] = v
+    return sys
+
+class Stats:
+    """
+    Counters for results(), recorded per call and per strongly
+    connected component, with the constrainer.Stats of each group.
+    as_dict() gives plain data that can be written out with json.
+    """
+    def __init__(self):
+        self.runs = []
+
+    def begin(self):
+        return RunStats()
+
+    def end(self, run):
+        run.time = time.perf_counter() - run.time
+        self.runs.append({"time": run.time, "skipped": run.skipped,
+                          "offloaded": run.offloaded,
+                          "missing": run.missing,
+                          "batches": run.batches,
+                          "components": run.components})
+
+    def as_dict(self):
+        return {"runs": self.runs}
+
+    def dump(self, fp):
+        json.dump(self.as_dict(), fp, indent=2)
+
+class RunStats:
+    def __init__(self):
+        self.time = time.perf_counter()
+        self.components = []
+        self.skipped = 0
+        self.offloaded = 0
+        self.missing = 0
+        self.batches = []
+        self.iterations = 0
+        self.solver_time = 0.0
+        self.start = 0.0
+
+    def enter(self, comp, systems):
+        self.iterations = 0
+        self.solver_time = 0.0
+        for g in comp:
+            sys = systems.get(g)
+            if sys is not None and sys.stats is None:
+                sys.stats = constrainer.Stats()
+        self.start = time.perf_counter()
+
+    def leave(self, comp, systems, converged):
+        groups = []
+        for g in comp:
+            sys = systems.get(g)
+            if sys is not None:
+                groups.append(dict(variables=len(g.cover),
+                                   constraints=len(g.constraints),
+                                   **sys.stats.as_dict()))
+                # Work done by later edits counts towards the next run.
+                sys.stats = constrainer.Stats()
+        self.components.append({
+            "groups": groups,
+            "solvers": sum(1 for g in comp if not isinstance(g, Group)),
+            "iterations": self.iterations,
+            "converged": converged,
+            "time": time.perf_counter() - self.start,
+            "solver_time": self.solver_time,
+        })
+
 class Group:
     def __init__(self):
         self.parent = None
@@ -132,6 +836,10 @@ class ConnectedVariables:
         group2 = self.find(group2)
         if group1 is group2:
             return group1
+        # The smaller group goes into the larger, so that building
+        # a long chain of constraints does not copy it over and over.
+        if len(group1.cover) < len(group2.cover):
+            group1, group2 = group2, group1
         group2.parent = group1
         group1.constraints.update(group2.constraints)
         group2.constraints = None
@@ -141,6 +849,11 @@ class ConnectedVariables:
         return group1
 
 def tarjans_scc(graph):
+    """
+    Strongly connected components of graph, every component
+    listed after the components it reaches. Iterative, so that
+    deep graphs do not run into the recursion limit.
+    """
     index = 0
     stack = []
     on_stack = set()
@@ -148,34 +861,59 @@ def tarjans_scc(graph):
     lowlink = {}
     result = []
 
-    def strongconnect(v):
-        nonlocal index
-        indices[v] = index
-        lowlink[v] = index
+    for root in graph:
+        if root in indices:
+            continue
+        indices[root] = lowlink[root] = index
         index += 1
-        stack.append(v)
-        on_stack.add(v)
-
-        for w in graph.get(v, []):
-            if w not in indices:
-                strongconnect(w)
-                lowlink[v] = min(lowlink[v], lowlink[w])
-            elif w in on_stack:
-                lowlink[v] = min(lowlink[v], indices[w])
-
-        if lowlink[v] == indices[v]:
-            comp = []
-            while True:
-                w = stack.pop()
-                on_stack.remove(w)
-                comp.append(w)
-                if w == v:
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph.get(root, [])))]
+        while work:
+            v, edges = work[-1]
+            for w in edges:
+                if w not in indices:
+                    indices[w] = lowlink[w] = index
+                    index += 1
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(graph.get(w, []))))
                     break
-            result.append(comp)
-
-    for v in graph:
-        if v not in indices:
-            strongconnect(v)
+                elif w in on_stack:
+                    lowlink[v] = min(lowlink[v], indices[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+                if lowlink[v] == indices[v]:
+                    comp = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.remove(w)
+                        comp.append(w)
+                        if w == v:
+                            break
+                    result.append(comp)
 
     return result
 
+def wavefronts(graph):
+    """
+    Strongly connected components of graph grouped into levels.
+    A component only reaches components in later levels, so the
+    components of one level can be solved in any order, or at once.
+    """
+    comps = tarjans_scc(graph)[::-1]
+    owner = {v: i for i, comp in enumerate(comps) for v in comp}
+    level = [0] * len(comps)
+    for i, comp in enumerate(comps):
+        for v in comp:
+            for w in graph.get(v, []):
+                j = owner[w]
+                if j != i and level[j] <= level[i]:
+                    level[j] = level[i] + 1
+    levels = [[] for _ in range(max(level, default=-1) + 1)]
+    for i, comp in enumerate(comps):
+        levels[level[i]].append(comp)
+    return levels
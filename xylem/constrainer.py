@@ -1,17 +1,281 @@
-from dataclasses import dataclass
+from array import array
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
 from typing import Dict, Union
+from . import trace
+import functools
+import threading
+import time
+
+DUMMY, FLEX, SLACK = range(3)
+
+# Kind of every variable, indexed by AbstractVariable.index.
+# Variables are created on executor and Relayout threads too,
+# so the index is taken and the kind written under a lock.
+_kinds_ = bytearray()
+_kinds_lock_ = threading.Lock()
+
+# Stats of the System that is currently running on this thread,
+# None if disabled. Per thread, since executor workers and the
+# Relayout thread run Systems alongside the main thread.
+class _Running_(threading.local):
+    stats = None
+
+_running_ = _Running_()
+
+class Stats:
+    """
+    Counters collected for a System while System.stats is set.
+    Times are per phase and exclusive: a phase does not include
+    the time spent in the phases it calls.
+    """
+    def __init__(self):
+        self.pivots = 0
+        self.degenerate_pivots = 0
+        self.rows_rewritten = 0
+        self.allocations = 0
+        self.time = {}
+        self.phase = None
+        self.mark = 0.0
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self.phase is not None:
+            self.time[self.phase] = self.time.get(self.phase, 0.0) + now - self.mark
+        outer, self.phase, self.mark = self.phase, phase, now
+        return outer
+
+    def update(self, other):
+        self.pivots += other.pivots
+        self.degenerate_pivots += other.degenerate_pivots
+        self.rows_rewritten += other.rows_rewritten
+        self.allocations += other.allocations
+        for phase, t in other.time.items():
+            self.time[phase] = self.time.get(phase, 0.0) + t
+
+    def as_dict(self):
+        return {
+            "pivots": self.pivots,
+            "degenerate_pivots": self.degenerate_pivots,
+            "rows_rewritten": self.rows_rewritten,
+            "allocations": self.allocations,
+            "time": dict(self.time),
+        }
+
+def _measured_(method):
+    # Collects into self.stats while a System method runs.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        running = _running_
+        stats = self.stats
+        if stats is running.stats:
+            return method(self, *args, **kwargs)
+        outer_stats, running.stats = running.stats, stats
+        if stats is None:
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                running.stats = outer_stats
+        outer = stats.enter(method.__name__)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            stats.enter(outer)
+            running.stats = outer_stats
+    return wrapper
+
+def _phase_(name, traced=True):
+    # Times a solver phase into the running stats, and traces
+    # it unless it runs once per row.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            stats = _running_.stats
+            if stats is None and (trace.tracer is None or not traced):
+                return fn(*args)
+            with trace.span(name) if traced else trace._off_:
+                if stats is None:
+                    return fn(*args)
+                outer = stats.enter(name)
+                try:
+                    return fn(*args)
+                finally:
+                    stats.enter(outer)
+        return wrapper
+    return decorator
 
 @dataclass(eq=False)
 class AbstractVariable:
-    pass
+    index : int = field(init=False, repr=False)
+
+    def __post_init__(self):
+        with _kinds_lock_:
+            self.index = len(_kinds_)
+            _kinds_.append(self.kind)
 
 @dataclass(eq=False)
 class Variable(AbstractVariable):
     slack : bool = False
 
+    @property
+    def kind(self):
+        return SLACK if self.slack else FLEX
+
 @dataclass(eq=False)
 class DVariable(AbstractVariable):
-    pass
+    kind = DUMMY
+
+class Results(MutableMapping):
+    """
+    Values of variables, stored in an array('d') that spans the
+    indices of the variables stored, from base up to the largest.
+    Works as a mapping from variables to values, and data and
+    present can be read as buffers without going through the
+    variables: data[i - base] holds the value of the variable at
+    index i, 0.0 where there is none, and present holds 1 where
+    there is.
+    """
+    def __init__(self, items=()):
+        self.base = 0
+        self.data = array('d')
+        self.present = bytearray()
+        self.variables = []
+        self.count = 0
+        self.update(items)
+
+    def _reserve_(self, lo, hi):
+        # Makes room for the indices lo to hi. Extends towards lower
+        # indices by at least the current span, so that variables
+        # arriving in falling order do not copy the arrays each time.
+        n = len(self.present)
+        if n == 0:
+            self.base = lo
+        elif lo < self.base:
+            k = self.base - max(0, min(lo, self.base - n))
+            self.data = array('d', bytes(8*k)) + self.data
+            self.present = bytearray(k) + self.present
+            self.variables = [None]*k + self.variables
+            self.base -= k
+        k = hi + 1 - self.base - len(self.present)
+        if k > 0:
+            self.data.frombytes(bytes(8*k))
+            self.present.extend(bytes(k))
+            self.variables.extend([None]*k)
+
+    def __getitem__(self, var):
+        i = var.index - self.base
+        if 0 <= i < len(self.present) and self.present[i]:
+            return self.data[i]
+        raise KeyError(var)
+
+    def get(self, var, default=None):
+        i = var.index - self.base
+        if 0 <= i < len(self.present) and self.present[i]:
+            return self.data[i]
+        return default
+
+    def __contains__(self, var):
+        i = var.index - self.base
+        return 0 <= i < len(self.present) and self.present[i] == 1
+
+    def __setitem__(self, var, value):
+        i = var.index - self.base
+        if not 0 <= i < len(self.present):
+            self._reserve_(var.index, var.index)
+            i = var.index - self.base
+        if not self.present[i]:
+            self.present[i] = 1
+            self.variables[i] = var
+            self.count += 1
+        self.data[i] = value
+
+    def __delitem__(self, var):
+        if var not in self:
+            raise KeyError(var)
+        i = var.index - self.base
+        self.data[i] = 0.0
+        self.present[i] = 0
+        self.variables[i] = None
+        self.count -= 1
+
+    def assign(self, values, tolerance=0.0):
+        """
+        Set the values of a mapping, and return the variables
+        that had no value or moved by more than tolerance.
+        """
+        if not values:
+            return []
+        indices = [var.index for var in values]
+        self._reserve_(min(indices), max(indices))
+        data, present, variables = self.data, self.present, self.variables
+        base = self.base
+        changed = []
+        for var, v in values.items():
+            i = var.index - base
+            if present[i]:
+                if abs(v - data[i]) > tolerance:
+                    changed.append(var)
+            else:
+                present[i] = 1
+                variables[i] = var
+                self.count += 1
+                changed.append(var)
+            data[i] = v
+        return changed
+
+    def take(self, other, variables):
+        """
+        Copy the values other has for the given variables.
+        """
+        found = [var for var in variables if var in other]
+        if not found:
+            return
+        indices = [var.index for var in found]
+        self._reserve_(min(indices), max(indices))
+        data, present, known = self.data, self.present, self.variables
+        odata = other.data
+        base, obase = self.base, other.base
+        for var in found:
+            i = var.index - base
+            if not present[i]:
+                present[i] = 1
+                known[i] = var
+                self.count += 1
+            data[i] = odata[var.index - obase]
+
+    def __iter__(self):
+        return (var for var in self.variables if var is not None)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"Results({dict(self)!r})"
+
+    def copy(self):
+        other = Results()
+        other.base = self.base
+        other.data = array('d', self.data)
+        other.present = bytearray(self.present)
+        other.variables = list(self.variables)
+        other.count = self.count
+        return other
+
+    def eval(self, expr):
+        data = self.data
+        base = self.base
+        n = len(data)
+        constant = expr.constant
+        for k, s in expr.coeffs.items():
+            i = k.index - base
+            if 0 <= i < n:
+                constant += data[i]*s
+        return constant
+
+def fresh(kind):
+    if kind == DUMMY:
+        return DVariable()
+    return Variable(kind == SLACK)
 
 def dummy():
     x = DVariable()
@@ -59,6 +323,11 @@ class LinearExpr:
     coeffs: Dict[Variable, float]
     constant: float
 
+    def __post_init__(self):
+        stats = _running_.stats
+        if stats is not None:
+            stats.allocations += 1
+
     def __add__(self, other):
         other = promote(other)
         coeffs = self.coeffs.copy()
@@ -106,6 +375,8 @@ class LinearExpr:
         raise Exception("constraint doesn't refer to one variable")
 
     def eval(self, results):
+        if isinstance(results, Results):
+            return results.eval(self)
         constant = self.constant
         for k, s in self.coeffs.items():
             constant += results.get(k, 0.0)*s
@@ -160,86 +431,426 @@ class LinearExpr:
         else:
             return self
 
+class Row:
+    """
+    Solver-internal counterpart of LinearExpr.
+    Keyed by variable index and updated in place.
+    """
+    __slots__ = ('coeffs', 'constant')
+
+    def __init__(self, coeffs, constant):
+        self.coeffs = coeffs
+        self.constant = constant
+        stats = _running_.stats
+        if stats is not None:
+            stats.allocations += 1
+
+    def add_scaled(self, row, factor):
+        coeffs = self.coeffs
+        for k, v in row.coeffs.items():
+            w = coeffs.get(k, 0.0) + v*factor
+            if w == 0.0:
+                coeffs.pop(k, None)
+            else:
+                coeffs[k] = w
+        self.constant += row.constant*factor
+
+    def subs(self, *ms):
+        coeffs = self.coeffs
+        for k in [k for k in coeffs if any(k in m for m in ms)]:
+            s = coeffs.pop(k)
+            for m in ms:
+                if k in m:
+                    self.add_scaled(m[k], s)
+                    break
+
+class Rows(dict):
+    """
+    A table of rows keyed by their basic variable (or strength).
+    Keeps a column index from each variable to the keys of the rows
+    that mention it, and the keys of the rows with a negative constant.
+    """
+    def __init__(self, rows=()):
+        super().__init__()
+        self.columns = {}
+        self.negative = set()
+        for k, c in dict(rows).items():
+            self[k] = c
+
+    def __setitem__(self, k, c):
+        if k in self:
+            self._unindex_(k, dict.__getitem__(self, k))
+        dict.__setitem__(self, k, c)
+        for v in c.coeffs:
+            self.columns.setdefault(v, set()).add(k)
+        if c.constant < 0.0:
+            self.negative.add(k)
+
+    def __delitem__(self, k):
+        self._unindex_(k, dict.__getitem__(self, k))
+        dict.__delitem__(self, k)
+
+    def pop(self, k, *default):
+        if k not in self:
+            return dict.pop(self, k, *default)
+        self._unindex_(k, dict.__getitem__(self, k))
+        return dict.pop(self, k)
+
+    def _unindex_(self, k, c):
+        for v in c.coeffs:
+            keys = self.columns[v]
+            keys.discard(k)
+            if not keys:
+                del self.columns[v]
+        self.negative.discard(k)
+
+    def mentioning(self, var):
+        return self.columns.get(var, ())
+
+    def subs(self, k, row):
+        columns = self.columns
+        keys = columns.pop(k, ())
+        stats = _running_.stats
+        if stats is not None:
+            stats.rows_rewritten += len(keys)
+        for i in keys:
+            c = dict.__getitem__(self, i)
+            coeffs = c.coeffs
+            s = coeffs.pop(k)
+            for v, w in row.coeffs.items():
+                x = coeffs.get(v, 0.0) + w*s
+                if x != 0.0:
+                    if v not in coeffs:
+                        columns.setdefault(v, set()).add(i)
+                    coeffs[v] = x
+                elif v in coeffs:
+                    del coeffs[v]
+                    keys = columns[v]
+                    keys.discard(i)
+                    if not keys:
+                        del columns[v]
+            c.constant += row.constant*s
+            if c.constant < 0.0:
+                self.negative.add(i)
+            else:
+                self.negative.discard(i)
+
+class Objective(Rows):
+    """
+    Objective rows keyed by strength. Also keeps the set of
+    variables whose reduced cost is lexicographically negative,
+    updated only for the columns that a change touches.
+    """
+    def __init__(self, rows=()):
+        self.entering = set()
+        super().__init__(rows)
+
+    def __setitem__(self, s, c):
+        old = dict.get(self, s)
+        super().__setitem__(s, c)
+        if old is not None:
+            self._leading_(old.coeffs)
+        self._leading_(c.coeffs)
+
+    def __delitem__(self, s):
+        self.pop(s)
+
+    def pop(self, s, *default):
+        if s not in self:
+            return dict.pop(self, s, *default)
+        c = super().pop(s)
+        self._leading_(c.coeffs)
+        return c
+
+    def subs(self, k, row):
+        if k in self.columns:
+            super().subs(k, row)
+            self._leading_((k,))
+            self._leading_(row.coeffs)
+
+    def _leading_(self, ks):
+        for k in ks:
+            keys = self.columns.get(k)
+            if keys and _kinds_[k] != DUMMY:
+                if dict.__getitem__(self, min(keys)).coeffs[k] < 0.0:
+                    self.entering.add(k)
+                    continue
+            self.entering.discard(k)
+
+    @property
+    def strengths(self):
+        return tuple(sorted(self))
+
 class System:
     def __init__(self, fixed=None):
         fixed = {} if fixed is None else fixed
-        self.fixed = {k: dummy() + v for k, v in fixed.items()}
+        self.variables = {k.index: k for k in fixed}
+        self.fixed = {k.index: self._row_(dummy() + v) for k, v in fixed.items()}
         self.constraints = set()
-        self.Cu = {}
-        self.Cv = {}
-        self.O = {}
+        self.edits = {}
+        self.aliases = {}
+        self.presolved = set()
+        self.Cu = Rows()
+        self.Cv = Rows()
+        self.O = Objective()
         self.resolve = False
+        # Assign a Stats() to collect counters and timings.
+        self.stats = None
 
+    @_measured_
     def add(self, constraint):
+        c = self._prepare_(constraint.expr)
+        _insert_equation_(self.Cu, self.Cv, c, _marker_(constraint))
         self.constraints.add(constraint)
-        _insert_equation_(self.Cu, self.Cv, constraint.expr.subs(self.fixed))
-        _insert_objective_(self.O, constraint.objective)
+        _insert_objective_(self.O, self._objective_(constraint.objective))
         self.resolve = True
 
+    @_measured_
+    def add_many(self, constraints):
+        """
+        Add constraints in bulk. Rows that can be solved for
+        an unrestricted variable are inserted before the rest,
+        and the objective is accumulated once.
+        """
+        rows = []
+        trivial = []
+        objective = {}
+        for constraint in constraints:
+            self.constraints.add(constraint)
+            c = self._prepare_(constraint.expr)
+            if not constraint.objective and _trivial_(c, constraint.marker):
+                trivial.append((c, constraint))
+            else:
+                rows.append((c, _marker_(constraint)))
+            for s, o in constraint.objective.items():
+                objective.setdefault(s, Row({}, 0.0)).add_scaled(self._row_(o), 1.0)
+        if trivial:
+            self._presolve_(trivial, rows)
+            for c, _ in rows:
+                c.subs(self.aliases)
+            for c in objective.values():
+                c.subs(self.aliases)
+        rows.sort(key=lambda r: all(_kinds_[k] != FLEX for k in r[0].coeffs))
+        for c, marker in rows:
+            _insert_equation_(self.Cu, self.Cv, c, marker)
+        _insert_objective_(self.O, objective)
+        self.resolve = True
+
+    @_phase_("presolve")
+    def _presolve_(self, trivial, rows):
+        """
+        Collapse required x = y + t and x = t equalities into
+        aliases with union-find, before they reach the tableau.
+        Variables already in the tableau stay as roots, and rows
+        that cannot be collapsed are passed on to the rows.
+        """
+        parent = {}
+        for k, c in self.aliases.items():
+            parent[k] = (next(iter(c.coeffs), None), c.constant)
+
+        def find(k):
+            path = []
+            while k in parent:
+                path.append(k)
+                k = parent[k][0]
+            off = 0.0
+            for j in reversed(path):
+                off += parent[j][1]
+                parent[j] = (k, off)
+            return k, off
+
+        def busy(k):
+            return (k in self.Cu or k in self.Cv or k in self.fixed
+                or self.Cu.mentioning(k) or self.Cv.mentioning(k)
+                or self.O.mentioning(k))
+
+        for c, constraint in trivial:
+            marker = constraint.marker.index
+            x, *y = [k for k in c.coeffs if k != marker]
+            t = -c.constant / c.coeffs[x]
+            rx, ox = find(x)
+            ry, oy = find(y[0]) if y else (None, 0.0)
+            # rx + ox = ry + oy + t
+            if rx == ry and ox == oy + t:
+                pass
+            elif rx != ry and rx is not None and not busy(rx):
+                parent[rx] = (ry, oy + t - ox)
+            elif rx != ry and ry is not None and not busy(ry):
+                parent[ry] = (rx, ox - oy - t)
+            else:
+                rows.append((c, marker))
+                continue
+            self.presolved.add(constraint)
+
+        for k in parent:
+            r, off = find(k)
+            self.aliases[k] = Row({} if r is None else {r: 1.0}, off)
+
+    def _prepare_(self, expr):
+        c = self._row_(expr)
+        c.subs(self.aliases)
+        c.subs(self.fixed)
+        return c
+
+    def _row_(self, expr):
+        coeffs = {}
+        for k, v in expr.coeffs.items():
+            self.variables[k.index] = k
+            coeffs[k.index] = float(v)
+        return Row(coeffs, float(expr.constant))
+
+    def _objective_(self, objective):
+        return {s: self._prepare_(o) for s, o in objective.items()}
+
+    def _expr_(self, row):
+        coeffs = {self.variables[k]: v for k, v in row.coeffs.items()}
+        return LinearExpr(coeffs, row.constant)
+
+    @_measured_
     def merge(self, other):
         """
         Precondition: self and other are disjoint.
         Postcondition: self/other are no longer used.
         """
         result = System()
+        result.variables = self.variables | other.variables
         result.fixed = self.fixed | other.fixed
         result.constraints = self.constraints | other.constraints
-        result.Cu = self.Cu | other.Cv
-        result.O = self.O | other.O
+        result.edits = self.edits | other.edits
+        result.aliases = self.aliases | other.aliases
+        result.presolved = self.presolved | other.presolved
+        result.Cu = Rows(self.Cu | other.Cu)
+        result.Cv = Rows(self.Cv | other.Cv)
+        result.O = Objective(self.O)
+        _insert_objective_(result.O, other.O)
         result.resolve = True
+        result.stats = self.stats
+        if result.stats is None:
+            result.stats = other.stats
+        elif other.stats is not None:
+            result.stats.update(other.stats)
         return result
 
     def discard(self, constraint):
-        if constraint in self.constraints:
-            _remove_objective_(self.O, constraint.objective)
-            _remove_equation_(self.Cu, self.Cv, self.O, constraint.marker)
-            self.constraints.discard(constraint)
-            self.resolve = True
+        self.discard_many((constraint,))
+
+    @_measured_
+    def discard_many(self, constraints):
+        constraints = [c for c in constraints if c in self.constraints]
+        self.constraints.difference_update(constraints)
+        if any(c in self.presolved for c in constraints):
+            # Aliases cannot be split again, start over without them.
+            self._rebuild_()
+        else:
+            for c in constraints:
+                o = self._objective_(c.objective)
+                _remove_objective_(self.O, o, self.Cu, self.Cv)
+                _remove_equation_(self.Cu, self.Cv, self.O, c.marker.index)
+        self.resolve = True
+
+    def _rebuild_(self):
+        constraints = self.constraints
+        fixed = self.fixed
+        edits = self.edits
+        self.constraints = set()
+        self.fixed = {}
+        self.edits = {}
+        self.aliases = {}
+        self.presolved = set()
+        self.Cu = Rows()
+        self.Cv = Rows()
+        self.O = Objective()
+        self.refine({self.variables[k]: c.constant for k, c in fixed.items()})
+        self.add_many(constraints)
+        self.edits = edits
+        for k, edit in edits.items():
+            value, edit.value = edit.value, 0.0
+            self.suggest_value(self.variables[k], value)
 
     def results(self):
         self.solve()
         results = {}
         for k, c in self.Cu.items():
-            results[k] = c.constant
+            results[self.variables[k]] = c.constant
             assert k not in self.fixed
         for k, c in self.Cv.items():
-            results[k] = c.constant
+            results[self.variables[k]] = c.constant
             assert k not in self.fixed
+        for k, c in self.aliases.items():
+            value = c.constant
+            for j, w in c.coeffs.items():
+                value += w*self._value_(j)
+            results[self.variables[k]] = value
         return results
 
+    def _value_(self, k):
+        for C in (self.Cu, self.Cv, self.fixed):
+            if k in C:
+                return C[k].constant
+        return 0.0
+
+    @_measured_
     def solve(self):
         if self.resolve:
             _minimize_(self.Cu, self.Cv, self.O)
             self.resolve = False
 
+    @_measured_
     def reset(self):
-        eqs = []
-        for k, v in self.fixed:
-            subs[v.var] = Constant({k: 1.0}, -v.constant)
-            if k in self.Cu:
-                eqs.append(_remove_(self.Cu, k))
-            elif k in self.Cv:
-                eqs.append(_remove_(self.Cv, k))
+        """
+        Release every fixed variable. Each one is tied back to the
+        dummy that stood in for it, and that dummy is then removed
+        like a constraint marker.
+        """
+        for k, row in self.fixed.items():
+            n, = row.coeffs
+            C = self.Cv if _kinds_[k] == SLACK else self.Cu
+            C[k] = Row({n: 1.0}, row.constant)
+            _remove_equation_(self.Cu, self.Cv, self.O, n)
         self.fixed.clear()
-        for eq in eqs:
-            _insert_equation_(self.Cu, self.Cv, eq.subs(subs))
-        _subs_(subs, self.Cu, self.Cv, self.O)
-        _dual_simplex_(self.Cu, self.Cv, self.O)
+        self.resolve = True
+
+    def fixes_only(self, variables):
+        """
+        True if refine() has fixed none but the given variables,
+        so that refining them again gives a cold solve's results.
+        """
+        keys = set()
+        for var in variables:
+            k = var.index
+            c = self.aliases.get(k)
+            if c is not None and c.coeffs:
+                k, = c.coeffs
+            keys.add(k)
+        return self.fixed.keys() <= keys
 
+    @_measured_
     def refine(self, fixed):
+        self.solve()
         changed = False
         subs = {}
         eqs = []
-        for k, v in fixed.items():
+        for var, v in fixed.items():
+            k = var.index
+            self.variables[k] = var
+            if k in self.aliases:
+                c = self.aliases[k]
+                if not c.coeffs:
+                    if c.constant != v:
+                        raise Exception("unsatisfiable")
+                    continue
+                k, = c.coeffs
+                v -= c.constant
             if k in self.fixed:
-                n = self.fixed[k].var
-                p = self.fixed[k].constant
+                row = self.fixed[k]
+                n, = row.coeffs
+                p = row.constant
                 if p != v:
-                    subs[n] = self.fixed[k] - p + (v - p)
-                    self.fixed[k] = LinearExpr(self.fixed[k].coeffs, v)
+                    subs[n] = Row({n: 1.0}, v - p)
+                    row.constant = float(v)
                     changed = True
             else:
-                self.fixed[k] = dummy() + v
+                self.fixed[k] = self._row_(dummy() + v)
                 subs[k] = self.fixed[k]
                 if k in self.Cu:
                     eqs.append(_remove_(self.Cu, k))
@@ -247,147 +858,297 @@ class System:
                     eqs.append(_remove_(self.Cv, k))
                 changed = True
         for eq in eqs:
-            _insert_equation_(self.Cu, self.Cv, eq.subs(subs))
+            eq.subs(subs)
+            _insert_equation_(self.Cu, self.Cv, eq, None)
+        if eqs:
+            # The objective is not kept up to date by these pivots.
+            self.resolve = True
         _subs_(subs, self.Cu, self.Cv, self.O)
         _dual_simplex_(self.Cu, self.Cv, self.O)
         return changed
 
+    def add_edit_var(self, var, strength):
+        """
+        Let var be driven by suggest_value(), starting from its
+        current value. The edit cannot be required, as a suggestion
+        may fall outside what the other constraints allow.
+        The suggested value enters the edit constraint through a dummy
+        variable, so changing it only shifts the rows of that column.
+        """
+        if strength is None:
+            raise ValueError("an edit variable needs a strength")
+        value = self.results().get(var, 0.0)
+        p = dummy()
+        c = eq(LinearExpr({var: 1.0}, 0.0) - p, strength)
+        self.add(c)
+        self.edits[var.index] = Edit(c, p.var.index, 0.0)
+        self.suggest_value(var, value)
+        return c
+
+    def remove_edit_var(self, var):
+        edit = self.edits.pop(var.index)
+        self.discard(edit.constraint)
+
+    @_measured_
+    def suggest_value(self, var, value):
+        edit = self.edits[var.index]
+        delta = value - edit.value
+        if delta == 0:
+            return False
+        self.solve()
+        edit.value = value
+        n = edit.parameter
+        _subs_({n: Row({n: 1.0}, delta)}, self.Cu, self.Cv, self.O)
+        _dual_simplex_(self.Cu, self.Cv, self.O)
+        return True
+
+    def snapshot(self, numbers):
+        """
+        Plain data for the tableau. Variables found in numbers are
+        written as their number, the rest as locals that restore()
+        creates anew. Constraints are written as their marker.
+        """
+        kinds = []
+        codes = {}
+        for k, var in self.variables.items():
+            if var in numbers:
+                codes[k] = numbers[var]
+            else:
+                codes[k] = -1 - len(kinds)
+                kinds.append(_kinds_[k])
+        def row(c):
+            return [c.constant, [[codes[k], v] for k, v in c.coeffs.items()]]
+        def expr(e):
+            return [e.constant, [[codes[v.index], w] for v, w in e.coeffs.items()]]
+        def table(C):
+            return [[codes[k], row(c)] for k, c in C.items()]
+        return {
+            "locals": kinds,
+            "variables": list(codes.values()),
+            "fixed": table(self.fixed),
+            "constraints": [codes[c.marker.index] for c in self.constraints],
+            "presolved": [codes[c.marker.index] for c in self.presolved],
+            "edits": [[codes[k],
+                       [expr(e.constraint.expr),
+                        [[s, expr(o)] for s, o in e.constraint.objective.items()],
+                        codes[e.constraint.marker.index]],
+                       codes[e.parameter], e.value]
+                      for k, e in self.edits.items()],
+            "aliases": table(self.aliases),
+            "Cu": table(self.Cu),
+            "Cv": table(self.Cv),
+            "O": [[s, row(c)] for s, c in self.O.items()],
+            "resolve": self.resolve,
+        }
+
+    @classmethod
+    def restore(cls, data, variables, constraints):
+        """
+        Rebuild a System from snapshot() data, given the variables
+        in order of their numbers and the constraints by marker.
+        """
+        kinds = [fresh(kind) for kind in data["locals"]]
+        def var(j):
+            return variables[j] if j >= 0 else kinds[-1 - j]
+        def row(c):
+            constant, coeffs = c
+            return Row({var(j).index: w for j, w in coeffs}, constant)
+        def expr(e):
+            constant, coeffs = e
+            return LinearExpr({var(j): w for j, w in coeffs}, constant)
+        def table(C, data):
+            for j, c in data:
+                C[var(j).index] = row(c)
+            return C
+        self = cls()
+        self.variables = {var(j).index: var(j) for j in data["variables"]}
+        table(self.fixed, data["fixed"])
+        markers = dict(constraints)
+        for j, (e, o, m), p, value in data["edits"]:
+            c = Constraint(expr(e), {s: expr(x) for s, x in o}, var(m))
+            markers[c.marker] = c
+            self.edits[var(j).index] = Edit(c, var(p).index, value)
+        self.constraints = {markers[var(j)] for j in data["constraints"]}
+        self.presolved = {markers[var(j)] for j in data["presolved"]}
+        table(self.aliases, data["aliases"])
+        table(self.Cu, data["Cu"])
+        table(self.Cv, data["Cv"])
+        for s, c in data["O"]:
+            self.O[s] = row(c)
+        self.resolve = data["resolve"]
+        return self
+
     def format(self, names):
         out = ["objective:"]
         for k, c in self.O.items():
-            out.append(f"  [{k}] = {c.format(names)}")
+            out.append(f"  [{k}] = {self._expr_(c).format(names)}")
         out.append("equations:")
         for k, c in self.Cu.items():
-            out.append(f"  {names.get(k)} = {c.format(names)}")
+            out.append(f"  {names.get(self.variables[k])} = {self._expr_(c).format(names)}")
         out.append('  ----')
         for k, c in self.Cv.items():
-            out.append(f"  {names.get(k)} = {c.format(names)}")
+            out.append(f"  {names.get(self.variables[k])} = {self._expr_(c).format(names)}")
+        if self.aliases:
+            out.append("aliases:")
+            for k, c in self.aliases.items():
+                out.append(f"  {names.get(self.variables[k])} = {self._expr_(c).format(names)}")
         return "\n".join(out)
 
-def _insert_equation_(Cu, Cv, c):
-    c = c.subs(Cu, Cv)
-    for k, v in c.coeffs.items():
-        if not isinstance(k, DVariable) and not k.slack:
+@_phase_("insert", traced=False)
+def _insert_equation_(Cu, Cv, c, marker):
+    c.subs(Cu, Cv)
+    for k in c.coeffs:
+        if _kinds_[k] == FLEX:
             _pivot_(Cu, c, k, Cu, Cv)
-            break
-    else:
-        c = c.positive()
-        while not c.is_zero:
-            k = min(_entering_variable_(c), key=id, default=None)
-            if k is None:
-                raise Exception("unsatisfiable")
-            p = c.constant / -c.coeffs[k]
-            j = min(_leaving_variable_(Cv, k, lambda q: q < p), key=_lvf_, default=(p,None))[1]
-            if j is None:
-                _pivot_(Cv, c, k, Cu, Cv)
-            else:
-                _pivot_(Cv, _remove_(Cv,j), k, Cu, Cv)
-            c = c.subs(Cv)
+            return
+    if c.constant < 0:
+        _negate_(c)
+    while c.constant != 0:
+        k = min(_entering_variable_(c), default=None)
+        if k is None:
+            raise Exception("unsatisfiable")
+        p = c.constant / -c.coeffs[k]
+        j = min(_leaving_variable_(Cv, k, lambda q: q < p), default=(p,None))[1]
+        if j is None:
+            _pivot_(Cv, c, k, Cu, Cv)
+            return
+        _pivot_(Cv, _remove_(Cv,j), k, Cu, Cv)
+        c.subs(Cv)
+    # The row already holds, any of its variables can be made basic.
+    # Redundant equalities end up with their dummy marker basic.
+    if c.coeffs:
+        k = min(_entering_variable_(c), default=None)
+        if k is None:
+            k = marker if marker in c.coeffs else min(c.coeffs)
+        _pivot_(Cv, c, k, Cu, Cv)
+
+def _marker_(constraint):
+    if constraint.marker is not None:
+        return constraint.marker.index
+
+def _trivial_(c, marker):
+    if not isinstance(marker, DVariable) or marker.index not in c.coeffs:
+        return False
+    ks = [k for k in c.coeffs if k != marker.index]
+    if not all(_kinds_[k] == FLEX for k in ks):
+        return False
+    if len(ks) == 1:
+        return True
+    if len(ks) == 2:
+        return c.coeffs[ks[0]] == -c.coeffs[ks[1]]
+    return False
+
+def _negate_(c):
+    for k, v in c.coeffs.items():
+        c.coeffs[k] = -v
+    c.constant = -c.constant
 
 def _entering_variable_(c):
     for k, s in c.coeffs.items():
-        if isinstance(k, DVariable):
+        if _kinds_[k] == DUMMY:
             continue
         if s >= 0.0:
             continue
         yield k
 
 def _insert_objective_(O, o):
-    zero = promote(0.0)
     for s, c in o.items():
-        O[s] = O.get(s, zero) + c
+        row = O.pop(s, None) or Row({}, 0.0)
+        row.add_scaled(c, 1.0)
+        O[s] = row
 
-def _remove_objective_(O, o):
-    zero = promote(0.0)
+def _remove_objective_(O, o, *Cs):
     for s, c in o.items():
-        O[s] = O.get(s, zero) - c
+        c.subs(*Cs)
+        row = O.pop(s, None) or Row({}, 0.0)
+        row.add_scaled(c, -1.0)
+        O[s] = row
 
+@_phase_("minimize")
 def _minimize_(Cu, Cv, O):
-    for s in O:
-        O[s] = O[s].subs(Cu, Cv)
-    k = min(_lex_entering_variable_(O), key=id, default=None)
+    for s in list(O):
+        row = O.pop(s)
+        row.subs(Cu, Cv)
+        O[s] = row
+    k = min(O.entering, default=None)
     while k is not None:
-        j = min(_leaving_variable_(Cv, k, lambda q: True), key=_lvf_, default=(0,None))[1]
+        j = min(_leaving_variable_(Cv, k, lambda q: True), default=(0,None))[1]
         if j is None:
             raise Exception("unbounded")
         _pivot_(Cv, _remove_(Cv, j), k, Cu, Cv, O)
-        k = min(_lex_entering_variable_(O), default=None, key=id)
-
-def _lex_entering_variable_(O):
-    strengths = tuple(sorted(O))
-    zero_vec = tuple(0.0 for _ in strengths)
-    for k in set().union(*[o.coeffs.keys() for o in O.values()]):
-        if isinstance(k, DVariable):
-            continue
-        vec = tuple(O[s].coeffs.get(k, 0.0) for s in strengths)
-        if vec < zero_vec:
-            yield k
+        k = min(O.entering, default=None)
 
+@_phase_("remove", traced=False)
 def _remove_equation_(Cu, Cv, O, marker):
     if marker in Cv:
         Cv.pop(marker)
         return
-    j = min(_leaving_variable_(Cv, marker, lambda q: True), key=_lvf_, default=(0,None))[1]
+    j = min(_leaving_variable_(Cv, marker, lambda q: True), default=(0,None))[1]
     if j is not None:
-        return _pivot_({}, remove(Cv, j), marker, Cu, Cv, O)
-    j = min(_leaving_variable_p_(Cv, marker), key=_lvf_, default=(0,None))[1]
+        return _pivot_({}, _remove_(Cv, j), marker, Cu, Cv, O)
+    j = min(_leaving_variable_p_(Cv, marker), default=(0,None))[1]
     if j is not None:
-        return _pivot_({}, remove(Cv, j), marker, Cu, Cv, O)
-    j = min((j for j in Cu if marker in Cu[j].coeffs), key=id, default=None)
+        return _pivot_({}, _remove_(Cv, j), marker, Cu, Cv, O)
+    j = min(Cu.mentioning(marker), default=None)
     if j is not None:
-        return _pivot_({}, remove(Cu, j), marker, Cu, Cv, O)
+        return _pivot_({}, _remove_(Cu, j), marker, Cu, Cv, O)
 
 def _remove_(C, k):
-    return C.pop(k) - LinearExpr({k: 1.0}, 0.0)
+    c = C.pop(k)
+    c.coeffs[k] = -1.0
+    return c
 
 def _leaving_variable_(Cv, k, cutoff):
-    for j, d in Cv.items():
-        if (w := d.coeffs.get(k, 0.0)) < 0.0:
+    for j in Cv.mentioning(k):
+        d = Cv[j]
+        if (w := d.coeffs[k]) < 0.0:
             q = d.constant / -w
             if cutoff(q):
                 yield q, j
 
 def _leaving_variable_p_(Cv, k):
-    for j, d in Cv.items():
-        if (w := d.coeffs.get(k, 0.0)) > 0.0:
+    for j in Cv.mentioning(k):
+        d = Cv[j]
+        if (w := d.coeffs[k]) > 0.0:
             q = d.constant / w
             yield q, j
 
+@_phase_("dual_simplex")
 def _dual_simplex_(Cu, Cv, O):
-    j = min((k for k,c in Cv.items() if c.constant < 0.0), key=id, default=None)
+    strengths = O.strengths
+    j = min(Cv.negative, default=None)
     while j is not None:
-        k = min(_dual_simplex_entering_variable_(Cv[j], O), key=_lvf_, default=(0,None))[1]
+        k = min(_dual_simplex_entering_variable_(Cv[j], O, strengths), default=(0,None))[1]
         if k is None:
             raise Exception("Infeasible")
         _pivot_(Cv, _remove_(Cv, j), k, Cu, Cv, O)
-        j = min((k for k,c in Cv.items() if c.constant < 0.0), key=id, default=None)
+        j = min(Cv.negative, default=None)
 
-def _dual_simplex_entering_variable_(row, O):
-    strengths = tuple(sorted(O))
+def _dual_simplex_entering_variable_(row, O, strengths):
     for k, a_ik in row.coeffs.items():
-        if isinstance(k, DVariable) or a_ik <= 0.0:
+        if _kinds_[k] == DUMMY or a_ik <= 0.0:
             continue
         vec = tuple(O[s].coeffs.get(k, 0.0) / a_ik for s in strengths)
         yield vec, k
 
 def _pivot_(C, c, k, *Upd):
-    coeffs = c.coeffs.copy()
-    constant = c.constant
-    s = coeffs.pop(k)
-    for h in coeffs.keys():
-        coeffs[h] = coeffs[h] / -s
-    constant /= -s
-    C[k] = LinearExpr(coeffs, constant)
-    _subs_(C, *Upd)
+    coeffs = c.coeffs
+    s = -coeffs.pop(k)
+    for h in coeffs:
+        coeffs[h] /= s
+    c.constant /= s
+    stats = _running_.stats
+    if stats is not None:
+        stats.pivots += 1
+        if c.constant == 0.0:
+            stats.degenerate_pivots += 1
+    C[k] = c
+    _subs_({k: c}, *Upd)
 
 def _subs_(C, *Upd):
-    for U in Upd:
-        for i in U:
-            U[i] = U[i].subs(C)
-
-def _lvf_(p):
-    x, y = p
-    return x, id(y)
+    for k, c in C.items():
+        for U in Upd:
+            U.subs(k, c)
 
 @dataclass(eq=False)
 class Constraint:
@@ -395,6 +1156,12 @@ class Constraint:
     objective : Dict[int, LinearExpr]
     marker    : AbstractVariable
 
+@dataclass(eq=False)
+class Edit:
+    constraint : Constraint
+    parameter  : int
+    value      : float
+
 def eq(expr, strength=None):
     if strength is None:
         marker = dummy()
@@ -1,3 +1,5 @@
+from . import trace
+
 class Solver:
     def __init__(self, node):
         self.node = node
@@ -14,7 +16,18 @@ class Solver:
             consumes.update(child.height.coeffs)
         return consumes, produces
 
+    @staticmethod
+    def solve_many(nodes, results):
+        values = {}
+        for node in nodes:
+            values.update(Solver(node).solve(results))
+        return values
+
     def solve(self, results):
+        with trace.node_span("knuth-plass", self.node):
+            return self._solve_(results)
+
+    def _solve_(self, results):
         values = {}
         y = 0
         for line in knuth_plass(self.node, results):
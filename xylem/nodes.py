@@ -1,7 +1,10 @@
 from dataclasses import dataclass, field
 from typing import Any, List, Dict, Union, Optional
 from .constrainer import LinearExpr, flex, slack, eq, les, ges, promote
+from . import trace
 from itertools import product
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
 
 @dataclass(eq=False)
 class Node:
@@ -14,11 +17,43 @@ class Node:
     height : LinearExpr = field(default_factory=flex)
     parent : Optional['Node'] = None
     nudgeteer : Optional[Any] = None
+    # The TreeIndex of the tree, built when a selector first needs it.
+    tree : Optional['TreeIndex'] = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
         for child in self.children:
             child.parent = self
 
+    def indexed(self):
+        if self.tree is None or self.tree.stale:
+            self.reindex()
+        return self.tree
+
+    def reindex(self):
+        # Call after changing tags or names, or children other
+        # than through insert(), append() and remove().
+        top = self
+        while top.parent is not None:
+            top = top.parent
+        TreeIndex(top)
+
+    def insert(self, index, child):
+        if child.tree is not None:
+            child.tree.stale = True
+        child.parent = self
+        self.children.insert(index, child)
+        if self.tree is not None:
+            self.tree.stale = True
+
+    def append(self, child):
+        self.insert(len(self.children), child)
+
+    def remove(self, child):
+        self.children.remove(child)
+        child.parent = None
+        if self.tree is not None:
+            self.tree.stale = True
+
     @property
     def bottom(self):
         return self.top + self.height
@@ -38,39 +73,151 @@ class Node:
     def orient_x(self, ancestor, x):
         if self == ancestor:
             return x - self.left
-        while self.parent != ancestor:
-            x += self.parent.left
-            self = self.parent
-        return x
+        if self.parent == ancestor:
+            return x
+        return orient(self, ancestor, "left", x)
 
     def orient_y(self, ancestor, y):
         if self == ancestor:
             return y - self.top
-        while self.parent != ancestor:
-            y += self.parent.top
-            self = self.parent
-        return y
+        if self.parent == ancestor:
+            return y
+        return orient(self, ancestor, "top", y)
 
     def relative_to(self):
         def _match_(node):
+            tree = self.indexed()
             result = []
             while node != self:
-                result.append(node.parent.children.index(node))
+                result.append(tree.position[tree.order[node]])
                 node = node.parent
             return result
         return _match_
 
+def orient(node, ancestor, attr, x):
+    # x plus attr of every node strictly between node and ancestor.
+    # Summed into one expression, rather than allocating a new one
+    # per step, with terms in the order the steps would give.
+    coeffs = dict(x.coeffs)
+    constant = x.constant
+    node = node.parent
+    while node is not ancestor:
+        step = getattr(node, attr)
+        for k, v in step.coeffs.items():
+            v += coeffs.get(k, 0.0)
+            if v == 0.0:
+                coeffs.pop(k, None)
+            else:
+                coeffs[k] = v
+        constant += step.constant
+        node = node.parent
+    return LinearExpr(coeffs, constant)
+
+class TreeIndex:
+    """
+    The nodes of a tree in preorder. The subtree of the node
+    numbered i covers the numbers i to end[i]-1, and tags and
+    names map to the sorted numbers of the nodes carrying them,
+    so selectors find matches by bisecting instead of walking.
+    position[i] is the place of the node among its siblings.
+    Node.insert() and Node.remove() mark the index stale,
+    and the next selector to use it numbers the tree again.
+    """
+    def __init__(self, root):
+        self.nodes = []
+        self.order = {}
+        self.position = []
+        self.tags = {}
+        self.names = {}
+        self.stale = False
+        stack = [(root, 0)]
+        while stack:
+            node, position = stack.pop()
+            i = len(self.nodes)
+            self.nodes.append(node)
+            self.order[node] = i
+            self.position.append(position)
+            self.tags.setdefault(node.tag, []).append(i)
+            self.names.setdefault(node.name, []).append(i)
+            node.tree = self
+            for k in reversed(range(len(node.children))):
+                stack.append((node.children[k], k))
+        self.end = list(range(1, len(self.nodes) + 1))
+        for i in reversed(range(len(self.nodes))):
+            children = self.nodes[i].children
+            if children:
+                self.end[i] = self.end[self.order[children[-1]]]
+
+    def is_first(self, node):
+        return self.position[self.order[node]] == 0
+
+    def is_last(self, node):
+        return self.position[self.order[node]] == len(node.parent.children) - 1
+
+    def lookup(self, hashed, pattern):
+        table = self.names if hashed else self.tags
+        return table.get(pattern, ())
+
+    def outermost(self, hashed, pattern, node):
+        # Matches inside the subtree of node that have no matching
+        # ancestor below node, in preorder.
+        hits = self.lookup(hashed, pattern)
+        i = self.order[node]
+        stop = self.end[i]
+        k = bisect_right(hits, i)
+        while k < len(hits) and hits[k] < stop:
+            j = hits[k]
+            yield self.nodes[j]
+            k = bisect_left(hits, self.end[j], k)
+
+    def children(self, hashed, pattern, node):
+        # Scans whichever is shorter, the matches
+        # inside the subtree or the children.
+        hits = self.lookup(hashed, pattern)
+        i = self.order[node]
+        lo = bisect_right(hits, i)
+        hi = bisect_left(hits, self.end[i], lo)
+        if hi - lo <= len(node.children):
+            for k in range(lo, hi):
+                child = self.nodes[hits[k]]
+                if child.parent is node:
+                    yield child
+        else:
+            m = matcher(hashed, pattern)
+            for child in node.children:
+                if m(child):
+                    yield child
+
 @dataclass(eq=False)
 class Selector:
     pass
 
 @dataclass(eq=False)
 class Expression:
-    pass
+    def fold(self):
+        return self
+
+    def eval(self, env, root):
+        # Compiles on every call, resolve() keeps the closures instead.
+        return self.compile(len(env))(list(env), root)
 
 @dataclass(eq=False)
 class Declaration:
-    pass
+    """
+    Declarations are compiled into closures, run with the
+    system, a frame holding the bound nodes and dimensions,
+    and the node they resolve in. Arguments are positions in
+    the frame, fixed at compile time from the depth of the
+    bindings around them. resolve() compiles on first use
+    and keeps the result, so do not edit a declaration after.
+    """
+    compiled = None
+
+    def resolve(self, system, env, root):
+        depth = len(env)
+        if self.compiled is None or self.compiled[0] != depth:
+            self.compiled = (depth, self.compile(depth))
+        self.compiled[1](system, list(env), root)
 
 @dataclass(eq=False)
 class Root(Selector):
@@ -83,10 +230,9 @@ class Some(Selector):
     hashed : bool = False
 
     def match(self, root):
-        m = matcher(self.hashed, self.pattern)
-        if m(root):
+        if matcher(self.hashed, self.pattern)(root):
             yield root
-        yield from dfs(m, root, [])
+        yield from root.indexed().outermost(self.hashed, self.pattern, root)
 
 @dataclass(eq=False)
 class Descendant(Selector):
@@ -95,9 +241,8 @@ class Descendant(Selector):
     hashed : bool = False
 
     def match(self, root):
-        m = matcher(self.hashed, self.pattern)
         for node in self.parent.match(root):
-            yield from dfs(m, node, [])
+            yield from node.indexed().outermost(self.hashed, self.pattern, node)
 
 @dataclass(eq=False)
 class AnyChild(Selector):
@@ -115,11 +260,8 @@ class Child(Selector):
     hashed : bool = False
 
     def match(self, root):
-        m = matcher(self.hashed, self.pattern)
         for node in self.parent.match(root):
-            for child in node.children:
-                if m(child):
-                    yield child
+            yield from node.indexed().children(self.hashed, self.pattern, node)
 
 @dataclass(eq=False)
 class First(Selector):
@@ -129,7 +271,7 @@ class First(Selector):
         for node in self.parent.match(root):
             if node.parent is None:
                 yield node
-            elif node.parent.children.index(node) == 0:
+            elif node.indexed().is_first(node):
                 yield node
 
 @dataclass(eq=False)
@@ -140,7 +282,7 @@ class Last(Selector):
         for node in self.parent.match(root):
             if node.parent is None:
                 yield node
-            elif node.parent.children.index(node) == len(node.parent.children) - 1:
+            elif node.indexed().is_last(node):
                 yield node
 
 @dataclass(eq=False)
@@ -150,14 +292,6 @@ class OneOf(Selector):
         for sel in self.seq:
             yield from sel.match(root)
 
-def dfs(f, node, output):
-    for child in node.children:
-        if f(child):
-            output.append(child)
-        else:
-            dfs(f, child, output)
-    return output
-
 def matcher(hashed, pattern):
     if hashed:
         return lambda node: node.name == pattern
@@ -167,8 +301,10 @@ def matcher(hashed, pattern):
 @dataclass(eq=False)
 class Number(Expression):
     value : float
-    def eval(self, env, root):
-        return self.value
+
+    def compile(self, depth):
+        value = self.value
+        return lambda frame, root: value
 
     def shift(self, f):
         return self
@@ -177,15 +313,16 @@ class Number(Expression):
 class Arg(Expression):
     index : int
 
-    def eval(self, env, root):
-        return env[-1-self.index]
+    def compile(self, depth):
+        position = depth - 1 - self.index
+        return lambda frame, root: frame[position]
 
     def shift(self, f):
         return Arg(f(self.index))
 
 class Self(Expression):
-    def eval(self, env, root):
-        return root
+    def compile(self, depth):
+        return lambda frame, root: root
 
     def shift(self, f):
         return self
@@ -193,8 +330,10 @@ class Self(Expression):
 @dataclass(eq=False)
 class String(Expression):
     value : str
-    def eval(self, env, root):
-        return self.value
+
+    def compile(self, depth):
+        value = self.value
+        return lambda frame, root: value
 
     def shift(self, f):
         return self
@@ -204,14 +343,21 @@ class Parameter(Expression):
     base : Expression
     name : str
 
-    def eval(self, env, root):
-        base = self.base.eval(env, root)
-        x = getattr(base, self.name)
+    def compile(self, depth):
+        base = self.base.compile(depth)
+        get = attrgetter(self.name)
         if self.name in ("left", "right", "xcenter"):
-            x = base.orient_x(root, x)
+            def _eval_(frame, root):
+                node = base(frame, root)
+                return node.orient_x(root, get(node))
         elif self.name in ("top", "bottom", "ycenter"):
-            x = base.orient_y(root, x)
-        return x
+            def _eval_(frame, root):
+                node = base(frame, root)
+                return node.orient_y(root, get(node))
+        else:
+            def _eval_(frame, root):
+                return get(base(frame, root))
+        return _eval_
 
     def shift(self, f):
         return Parameter(self.base.shift(f), self.name)
@@ -221,69 +367,153 @@ class Op(Expression): # Use with operator interface.
     op   : Any
     args : List[Expression]
 
-    def eval(self, env, root):
-        return self.op(*(x.eval(env, root) for x in self.args))
+    def fold(self):
+        args = [x.fold() for x in self.args]
+        if all(isinstance(x, Number) for x in args):
+            try:
+                return Number(self.op(*(x.value for x in args)))
+            except Exception:
+                # Left for evaluation to raise, if a rule
+                # ever matches and evaluates it.
+                pass
+        return Op(self.op, args)
+
+    def compile(self, depth):
+        folded = self.fold()
+        if isinstance(folded, Number):
+            return folded.compile(depth)
+        op = folded.op
+        args = [x.compile(depth) for x in folded.args]
+        if len(args) == 1:
+            a, = args
+            return lambda frame, root: op(a(frame, root))
+        if len(args) == 2:
+            a, b = args
+            return lambda frame, root: op(a(frame, root), b(frame, root))
+        return lambda frame, root: op(*(x(frame, root) for x in args))
 
     def shift(self, f):
         return Op(self.op, [x.shift(f) for x in self.args])
 
+def compile_arg(arg, depth):
+    if isinstance(arg, Expression):
+        return arg.compile(depth)
+    return lambda frame, root: arg
+
 @dataclass(eq=False)
 class Dim(Declaration):
     body : Declaration
     slack : bool = False
 
-    def resolve(self, system, env, root):
-        x = slack() if self.slack else flex()
-        self.body.resolve(system, env + (x,), root)
+    def compile(self, depth):
+        body = self.body.compile(depth + 1)
+        fresh = slack if self.slack else flex
+        def _run_(system, frame, root):
+            frame.append(fresh())
+            body(system, frame, root)
+            frame.pop()
+        return _run_
 
 @dataclass(eq=False)
 class Descend(Declaration):
     sel  : Selector
     body : Declaration
 
-    def resolve(self, system, env, root):
-        for node in self.sel.match(root):
-            self.body.resolve(system, env, node)
+    def compile(self, depth):
+        match = self.sel.match
+        body = self.body.compile(depth)
+        def _run_(system, frame, root):
+            for node in match(root):
+                with trace.node_span("descend", node):
+                    body(system, frame, node)
+        return _run_
 
 @dataclass(eq=False)
 class Match(Declaration):
     args : List[Selector]
     body : Declaration
 
-    def resolve(self, system, env, root):
-        for p in product(*(sel.match(root) for sel in self.args)):
-            self.body.resolve(system, env + p, root)
+    def compile(self, depth):
+        # Selectors match relative to root and never to another
+        # binding, so the factors are planned once: repeated
+        # selectors are evaluated once, evaluation stops at the first
+        # empty factor, and the lists are kept while the body of an
+        # enclosing Match or Dim runs this again on the same root.
+        factors = {}
+        slots = [factors.setdefault(repr(sel), (len(factors), sel))[0]
+                 for sel in self.args]
+        sels = [sel for _, sel in factors.values()]
+        body = self.body.compile(depth + len(slots))
+        memo = [None, None, None]
+        def _plan_(root):
+            tree = root.indexed()
+            if memo[0] is root and memo[1] is tree:
+                return memo[2]
+            lists = []
+            for sel in sels:
+                lists.append(list(sel.match(root)))
+                if not lists[-1]:
+                    break
+            memo[:] = root, tree, lists
+            return lists
+        def _run_(system, frame, root):
+            with trace.node_span("match", root):
+                lists = _plan_(root)
+                if len(lists) < len(sels) or not lists[-1]:
+                    return
+                for p in product(*(lists[i] for i in slots)):
+                    frame.extend(p)
+                    body(system, frame, root)
+                    del frame[depth:]
+        return _run_
 
 @dataclass(eq=False)
 class AtEmpty(Declaration):
     sel  : Selector
     body : Declaration
 
-    def resolve(self, system, env, root):
-        first = next(self.sel.match(root), None)
-        if first is None:
-            self.body.resolve(system, env, root)
+    def compile(self, depth):
+        match = self.sel.match
+        body = self.body.compile(depth)
+        def _run_(system, frame, root):
+            if next(match(root), None) is None:
+                body(system, frame, root)
+        return _run_
 
 @dataclass(eq=False)
 class Adjacent(Declaration):
     sel  : Selector
     body : Declaration
 
-    def resolve(self, system, env, root):
-        seq = list(self.sel.match(root))
-        seq.sort(key=root.relative_to())
-        for a, b in zip(seq, seq[1:]):
-            self.body.resolve(system, env + (a,b), root)
+    def compile(self, depth):
+        match = self.sel.match
+        body = self.body.compile(depth + 2)
+        def _run_(system, frame, root):
+            seq = list(match(root))
+            seq.sort(key=root.indexed().order.__getitem__)
+            for a, b in zip(seq, seq[1:]):
+                frame.append(a)
+                frame.append(b)
+                body(system, frame, root)
+                del frame[depth:]
+        return _run_
 
 @dataclass(eq=False)
 class Anchor(Declaration):
     op   : Any
     args : List[Any]
 
-    def resolve(self, system, env, root):
-        args =  [arg.eval(env, root) if isinstance(arg, Expression) else arg for arg in self.args]
-        c = self.op(*args)
-        system.add_constraint(c)
+    def compile(self, depth):
+        op = self.op
+        args = [compile_arg(arg, depth) for arg in self.args]
+        if len(args) == 1:
+            a, = args
+            def _run_(system, frame, root):
+                system.add_constraint(op(a(frame, root)))
+        else:
+            def _run_(system, frame, root):
+                system.add_constraint(op(*[x(frame, root) for x in args]))
+        return _run_
 
 @dataclass(eq=False)
 class Tile:
@@ -291,13 +521,13 @@ class Tile:
 
 @dataclass(eq=False)
 class Edge(Tile):
-    def chain(self, column, system, env, root, x):
-        if x is not None:
-            if column:
-                system.add_constraint(les(x - root.height, 0))
-            else:
-                system.add_constraint(les(x - root.width, 0))
-        return promote(0)
+    def compile(self, column, depth):
+        size = attrgetter("height" if column else "width")
+        def _chain_(system, frame, root, x):
+            if x is not None:
+                system.add_constraint(les(x - size(root), 0))
+            return promote(0)
+        return _chain_
 
     def shift(self, f):
         return self
@@ -305,11 +535,14 @@ class Edge(Tile):
 @dataclass(eq=False)
 class Space(Tile):
     expr : Expression
-    def chain(self, column, system, env, root, x):
-        if x is None:
-            return None
-        expr = self.expr.eval(env, root)
-        return x + expr
+
+    def compile(self, column, depth):
+        expr = self.expr.compile(depth)
+        def _chain_(system, frame, root, x):
+            if x is None:
+                return None
+            return x + expr(frame, root)
+        return _chain_
 
     def shift(self, f):
         return Space(self.expr.shift(f))
@@ -317,18 +550,22 @@ class Space(Tile):
 @dataclass(eq=False)
 class Cell(Tile):
     node : Expression
-    def chain(self, column, system, env, root, x):
-        node = self.node.eval(env, root)
+
+    def compile(self, column, depth):
+        node = self.node.compile(depth)
         if column:
-            if x is not None:
-                top = node.orient_y(root, node.top)
-                system.add_constraint(eq(top - x))
-            return node.orient_y(root, node.bottom)
+            def _chain_(system, frame, root, x):
+                n = node(frame, root)
+                if x is not None:
+                    system.add_constraint(eq(n.orient_y(root, n.top) - x))
+                return n.orient_y(root, n.bottom)
         else:
-            if x is not None:
-                left = node.orient_x(root, node.left)
-                system.add_constraint(eq(left - x))
-            return node.orient_x(root, node.right)
+            def _chain_(system, frame, root, x):
+                n = node(frame, root)
+                if x is not None:
+                    system.add_constraint(eq(n.orient_x(root, n.left) - x))
+                return n.orient_x(root, n.right)
+        return _chain_
 
     def shift(self, f):
         return Cell(self.node.shift(f))
@@ -338,24 +575,33 @@ class VisualFormat(Declaration):
     column : bool
     tiles : List[Tile]
 
-    def resolve(self, system, env, root):
-        x = None
-        for tile in self.tiles:
-            x = tile.chain(self.column, system, env, root, x)
+    def compile(self, depth):
+        tiles = [tile.compile(self.column, depth) for tile in self.tiles]
+        def _run_(system, frame, root):
+            x = None
+            for chain in tiles:
+                x = chain(system, frame, root, x)
+        return _run_
 
 @dataclass(eq=False)
 class Many(Declaration):
     body : List[Declaration]
 
-    def resolve(self, system, env, root):
-        for decl in self.body:
-            decl.resolve(system, env, root)
+    def compile(self, depth):
+        body = [decl.compile(depth) for decl in self.body]
+        def _run_(system, frame, root):
+            for decl in body:
+                decl(system, frame, root)
+        return _run_
 
 @dataclass(eq=False)
 class Relation(Declaration):
     name : str
     args : List[Any]
 
-    def resolve(self, system, env, root):
-        args =  [arg.eval(env, root) if isinstance(arg, Expression) else arg for arg in self.args]
-        system.add_relation(self.name, root, args)
+    def compile(self, depth):
+        name = self.name
+        args = [compile_arg(arg, depth) for arg in self.args]
+        def _run_(system, frame, root):
+            system.add_relation(name, root, [x(frame, root) for x in args])
+        return _run_
@@ -9,6 +9,7 @@ from .nodes import (
     Edge, Space, Cell, Relation
 )
 from .constrainer import eq, le, ge, les, ges
+from . import trace
 
 def _load_parser_():
     lark_file = resources.files(__package__).joinpath("stylesheet.lark")
@@ -17,7 +18,8 @@ def _load_parser_():
     return Lark(grammar, start="start", parser="lalr")
 
 def parse(text):
-    return ASTBuilder().transform(parser.parse(text))
+    with trace.span("parse", size=len(text)):
+        return ASTBuilder().transform(parser.parse(text))
 
 def many(decls):
     if len(decls) == 1:
@@ -0,0 +1,59 @@
+"""
+Spans of layout work, exported as Chrome trace events. Set tracer
+to a Tracer, or anything with the same span() method, and load the
+output of Tracer.dump() in chrome://tracing or ui.perfetto.dev.
+"""
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+# The active tracer, None when tracing is off.
+tracer = None
+
+_off_ = nullcontext()
+
+def span(event, **args):
+    if tracer is None:
+        return _off_
+    return tracer.span(event, args)
+
+def node_args(node):
+    return {"tag": node.tag, "name": node.name}
+
+def node_span(event, node):
+    # span() for work on a node, without building
+    # its arguments when tracing is off.
+    if tracer is None:
+        return _off_
+    return tracer.span(event, node_args(node))
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, event, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append({
+                "name": event,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": args,
+            })
+
+    def as_dict(self):
+        return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+
+    def dump(self, fp):
+        json.dump(self.as_dict(), fp)